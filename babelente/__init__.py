@@ -1 +1,8 @@
 VERSION = "0.5.0"
+
+def __getattr__(name):
+    #the engine is imported on first access, so importing a submodule (e.g. babelente.progress) stays cheap
+    if name == 'BabelEnte':
+        from babelente.babelente import BabelEnte
+        return BabelEnte
+    raise AttributeError("module 'babelente' has no attribute " + repr(name))
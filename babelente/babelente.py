@@ -9,26 +9,34 @@ import sys
 import os.path
 import argparse
 import json
-import requests
-import numpy as np
+import math
 import pickle
 import random
+import time
+import bisect
+import fcntl
 from collections import Counter, defaultdict
-from babelpy.babelfy import BabelfyClient
 from babelente import VERSION
-from folia import main as folia
+from babelente.progress import Progress, ProgressFile
+from babelente.keypool import KeyPool, loadkeys, redact
+from babelente.budget import Budget, BudgetExhausted, lineranges, complementranges
+from babelente.locallinker import LocalLinker
+from babelente.lineindex import loadlineindex, linecount
 
+#Note: the heavier subsystems (the BabelFy client, requests, numpy, FoLiA and the work queue) are imported only where they
+#are needed, so modes that do not need them (e.g. --dryrun, --evalfile) start quickly. See benchmarks/startup.py
 
-def gettextchunks(lines, maxchunksize=4096):
-    """Partition lines into text chunks"""
+
+def gettextchunks(lines, maxchunksize=4096, boundaries=()):
+    """Partition lines into text chunks, a new chunk is also started at each of the line numbers in boundaries (e.g. the first lines of documents)"""
     offsetmap = {} #(begin, end) tuple for the line
     firstlinenr = 0
     lastlinenr = 0
     text = ""
+    textsize = 0 #size of text in bytes (utf-8), tracked incrementally rather than re-encoding the whole chunk for every line
     for i, line in enumerate(lines):
-        s = text + line
-        s = s.encode('utf-8')
-        if len(s) + 1 >= maxchunksize:
+        linesize = len(line.encode('utf-8'))
+        if textsize + linesize + 1 >= maxchunksize or i in boundaries:
             #yield the current chunk
             if text:
                 yield text, firstlinenr, lastlinenr, offsetmap
@@ -36,15 +44,18 @@ def gettextchunks(lines, maxchunksize=4096):
             #start a new chunk
             offsetmap = {i: (0,len(line))}
             text = line
+            textsize = linesize
             firstlinenr = i
             lastlinenr = i
         else:
             if text:
                 begin = len(text) + 1
                 text += "\n" + line
+                textsize += linesize + 1
             else:
                 begin = 0
                 text = line
+                textsize = linesize
             lastlinenr = i
             offsetmap[i] = (begin, begin+len(line))
 
@@ -79,8 +90,62 @@ def resolveoffset(offsetmap, offset, lines, entity):
         if maxoffset is None or end > maxoffset: maxoffset = end
     raise ValueError("Unable to resolve offset " + str(offset) + "; minoffset=" + str(minoffset) + ", maxoffset=" + str(maxoffset) + ", lines=" + str(len(offsetmap)) )
 
-def findentities(lines, lang, args, cache=None):
-    """Find entities using BabelFy given a set of input lines"""
+#HTTP status codes with which BabelFy/BabelNet reject a key (invalid, or quota reached)
+REJECTIONCODES = (401, 403, 429)
+
+#words by which the messages BabelFy/BabelNet return instead of results identify a rejected key (e.g. "Your key is not valid or the daily requests limit has been reached")
+REJECTIONWORDS = ('key', 'limit', 'quota')
+
+def keyrejected(message):
+    """Returns True if a message returned instead of results says the key was rejected (invalid, or quota reached), rather than that the query itself failed"""
+    message = message.lower()
+    return any( word in message for word in REJECTIONWORDS )
+
+def acquirekey(keypool, budget, apikey=None):
+    """Charge a query to the budget and acquire a key from the pool for it. When no usable keys remain, the budget is stopped (reason 'quota'), as no more queries can be made.
+    Raises BudgetExhausted if the budget does not allow another query"""
+    if budget.exhausted() is None and keypool.exhausted(apikey):
+        print("WARNING: No usable API keys left, no more queries will be made",file=sys.stderr)
+        budget.stop('quota')
+    budget.charge()
+    return keypool.acquire(apikey)
+
+def querybabelfy(clients, babelfy_params, text, apikey=None, keypool=None, budget=None, progress=None):
+    """Query BabelFy for the text with a key from the pool, failing over to the next key when a key is rejected. Clients are kept per key in the clients dictionary. Returns the entities.
+    Raises BudgetExhausted if the budget does not allow another query, and RuntimeError if BabelFy returns any other error than a rejected key"""
+    if keypool is None: keypool = KeyPool()
+    if budget is None: budget = Budget()
+    if progress is None: progress = Progress()
+    from urllib.error import HTTPError
+    from babelpy.babelfy import BabelfyClient
+    while True:
+        key = acquirekey(keypool, budget, apikey)
+        if key not in clients:
+            clients[key] = BabelfyClient(key, dict(babelfy_params))
+        progress.querystart()
+        try:
+            clients[key].babelfy(text, dict(babelfy_params)) #parameters are passed per query as a client may be reused for other languages
+        except HTTPError as e:
+            if e.code not in REJECTIONCODES:
+                raise
+            print("WARNING: API key " + redact(key) + " rejected by BabelFy (HTTP " + str(e.code) + "), failing over to the next key",file=sys.stderr)
+            keypool.reject(key, "HTTP " + str(e.code))
+            continue
+        finally:
+            progress.querydone()
+        if isinstance(clients[key]._data, dict):
+            #BabelFy returns a message instead of results when the key is invalid or its quota is reached, but also when the query itself failed
+            message = str(clients[key]._data.get('message', ''))
+            if not keyrejected(message):
+                raise RuntimeError("BabelFy returned an error: " + message)
+            print("WARNING: API key " + redact(key) + " rejected by BabelFy (" + message + "), failing over to the next key",file=sys.stderr)
+            keypool.reject(key, message)
+            continue
+        keypool.used(key, 'babelfy')
+        return clients[key].entities
+
+def babelfyparams(args, lang):
+    """Returns the BabelFy parameters for the specified language"""
     babelfy_params = dict()
     babelfy_params['lang'] = lang.upper()
     if args.cands is not None:
@@ -101,30 +166,107 @@ def findentities(lines, lang, args, cache=None):
         babelfy_params['extAida'] = "true"
     if args.postag is not None:
         babelfy_params['posTag'] = args.postag
-    babelclient = BabelfyClient(args.apikey, babelfy_params)
-    for i, (text, firstlinenr, lastlinenr, offsetmap) in enumerate(gettextchunks(lines, maxchunksize=4096)):
-        if args.dryrun:
-            print("---\nCHUNK #" + str(i) + ". Would run query for firstlinenr=" + str(firstlinenr) + ", lastlinenr=" + str(lastlinenr), " text=" + text,file=sys.stderr)
+    return babelfy_params
+
+def findchunkentities(i, chunk, lines, babelfy_params, args, cache, clients, skipped, keypool, budget, progress):
+    """Find the entities of a single chunk (as produced by gettextchunks()), from the cache or by querying BabelFy. Returns copies of the entities with their line numbers and offsets resolved.
+    If the chunk can not be queried because the budget is exhausted, no entities are returned and its line numbers are added to the skipped set (if passed)"""
+    text, firstlinenr, lastlinenr, offsetmap = chunk
+    if args.dryrun:
+        print("---\nCHUNK #" + str(i) + ". Would run query for firstlinenr=" + str(firstlinenr) + ", lastlinenr=" + str(lastlinenr), " text=" + text,file=sys.stderr)
+        print("Offsetmap:", repr(offsetmap), file=sys.stderr)
+        progress.advance(len(offsetmap))
+        return []
+    elif cache is not None and text in cache:
+        entities = cache[text]
+        print("chunk #" + str(i) + " -- retrieved from cache",file=sys.stderr)
+        progress.cachehit()
+    else:
+        print("chunk #" + str(i) + " -- querying BabelFy",file=sys.stderr)
+        try:
+            entities = querybabelfy(clients, babelfy_params, text, args.apikey, keypool, budget, progress)
+        except BudgetExhausted as e:
+            print("chunk #" + str(i) + " -- skipped, budget exhausted (" + str(e) + ")",file=sys.stderr)
+            if skipped is not None: skipped.update(offsetmap)
+            progress.advance(len(offsetmap))
+            return []
+        if cache is not None: cache[text] = entities #put in cache
+    progress.advance(len(offsetmap))
+    #work on copies, the entities in the cache are shared by all chunks with the same text
+    entities = [ dict(entity) for entity in entities ]
+    results = []
+    for j, entity in enumerate(resolveoverlap(entities, args.overlap)):
+        try:
+            entity['linenr'], entity['offset'] = resolveoffset(offsetmap, entity['start'], lines, entity)
+            if 'ignore' not in entity or not entity['ignore']:
+                results.append(entity)
+        except ValueError as e:
+            print("---\nCHUNK #" + str(i) + " ENTITY #" + str(j) + ". Ran query for firstlinenr=" + str(firstlinenr) + ", lastlinenr=" + str(lastlinenr), " text=" + text,file=sys.stderr)
+            print("Entity:", repr(entity), file=sys.stderr)
             print("Offsetmap:", repr(offsetmap), file=sys.stderr)
-        elif cache is not None and text in cache:
-            entities = cache[text]
-            print("chunk #" + str(i) + " -- retrieved from cache",file=sys.stderr)
-        else:
-            print("chunk #" + str(i) + " -- querying BabelFy",file=sys.stderr)
-            babelclient.babelfy(text)
-            entities = babelclient.entities
-            if cache is not None: cache[text] = entities #put in cache
-        if not args.dryrun:
-            for j, entity in enumerate(resolveoverlap(entities, args.overlap)):
-                try:
-                    entity['linenr'], entity['offset'] = resolveoffset(offsetmap, entity['start'], lines, entity)
-                    if 'ignore' not in entity or not entity['ignore']:
-                        yield entity
-                except ValueError as e:
-                    print("---\nCHUNK #" + str(i) + " ENTITY #" + str(j) + ". Ran query for firstlinenr=" + str(firstlinenr) + ", lastlinenr=" + str(lastlinenr), " text=" + text,file=sys.stderr)
-                    print("Entity:", repr(entity), file=sys.stderr)
-                    print("Offsetmap:", repr(offsetmap), file=sys.stderr)
-                    raise e
+            raise e
+    return results
+
+def findentities(lines, lang, args, cache=None, chunks=None, clients=None, skipped=None, keypool=None, budget=None, progress=None, boundaries=()):
+    """Find entities using BabelFy given a set of input lines. The lines are partitioned into chunks by gettextchunks() (starting a new chunk at the boundaries) unless precomputed chunks are passed.
+    Pass a dictionary as clients to reuse the BabelFy clients (one per API key) over multiple calls.
+    Chunks that can not be queried because the budget is exhausted are skipped, their line numbers are added to the skipped set (if passed)"""
+    if keypool is None: keypool = KeyPool()
+    if budget is None: budget = Budget()
+    if progress is None: progress = Progress()
+    babelfy_params = babelfyparams(args, lang)
+    babelclients = {} if clients is None else clients #one client per API key
+    if chunks is None:
+        chunks = gettextchunks(lines, maxchunksize=4096, boundaries=boundaries)
+        progress.begin("extraction (" + lang.lower() + ")", len(lines))
+    else:
+        progress.begin("extraction (" + lang.lower() + ")", sum(len(offsetmap) for _, _, _, offsetmap in chunks))
+    for i, chunk in enumerate(chunks):
+        for entity in findchunkentities(i, chunk, lines, babelfy_params, args, cache, babelclients, skipped, keypool, budget, progress):
+            yield entity
+    progress.end()
+
+def linkchunks(lines, args, linker, cache=None, boundaries=()):
+    """Resolve lines locally with the lexicon-based linker where possible (see linkentities()). Returns the entities of the resolved lines
+    and the chunks that remain to be looked up in the cache or queried: the cached chunks and the chunks of the lines the linker could not resolve"""
+    entities = []
+    chunks = []
+    deferred = []
+    uncachedchunks = 0
+    for chunk in gettextchunks(lines, maxchunksize=4096, boundaries=boundaries):
+        text, firstlinenr, lastlinenr, _ = chunk
+        if cache is not None and text in cache:
+            chunks.append(chunk)
+            continue
+        uncachedchunks += 1
+        for linenr in range(firstlinenr, lastlinenr+1):
+            localentities = linker.link(lines[linenr])
+            if localentities is None:
+                deferred.append(linenr)
+                linker.deferredlines += 1
+            else:
+                linker.resolvedlines += 1
+                linker.avoidedbytes += len(lines[linenr].encode('utf-8'))
+                for entity in resolveoverlap(localentities, args.overlap):
+                    entity['linenr'] = linenr
+                    entity['offset'] = entity['start']
+                    entities.append(entity)
+    cachedchunks = len(chunks)
+    #the deferred lines are chunked anew (still starting a new chunk at each boundary), mapped back to their original line numbers
+    boundaries = sorted(boundaries)
+    deferredboundaries = { i for i in range(1, len(deferred)) if bisect.bisect_right(boundaries, deferred[i-1]) != bisect.bisect_right(boundaries, deferred[i]) }
+    for text, firstlinenr, lastlinenr, offsetmap in gettextchunks([ lines[linenr] for linenr in deferred ], maxchunksize=4096, boundaries=deferredboundaries):
+        chunks.append( (text, deferred[firstlinenr], deferred[lastlinenr], { deferred[i]: span for i, span in offsetmap.items() }) )
+    linker.avoidedrequests += uncachedchunks - (len(chunks) - cachedchunks)
+    return entities, chunks
+
+def linkentities(lines, lang, args, linker, cache=None, clients=None, skipped=None, keypool=None, budget=None, progress=None, boundaries=()):
+    """Find entities like findentities(), but resolve lines locally with the lexicon-based linker where possible.
+    Chunks that are already cached are looked up as usual, the remaining lines the linker can not resolve with confidence are passed on to BabelFy. Entities are returned in line order"""
+    entities, chunks = linkchunks(lines, args, linker, cache, boundaries)
+    entities += list(findentities(lines, lang, args, cache, chunks, clients, skipped, keypool, budget, progress))
+    entities.sort(key=lambda entity: entity['linenr'])
+    return entities
 
 def resolveoverlap(entities, overlapstrategy):
     overlapstrategy = overlapstrategy.lower()
@@ -175,7 +317,7 @@ def resolveoverlap(entities, overlapstrategy):
 def compute_coverage_line(line, linenr, entities):
     """Computes coverage of entities; expressed as ratio of characters covered; for a single line"""
     l = len(line)
-    charmask = np.zeros(l, dtype=np.int8)
+    charmask = bytearray(l)
     for entity in entities:
         if entity['linenr'] == linenr:
             for i in range( entity['offset'], entity['offset'] + (entity['end'] - entity['start'])+1):
@@ -185,35 +327,55 @@ def compute_coverage_line(line, linenr, entities):
                     print("WARNING: coverage out of range: ",i," in ",l,file=sys.stderr)
         elif entity['linenr'] > linenr: #they are returned in order
             break
-    coverage = charmask.sum()
+    coverage = sum(charmask)
     if coverage: coverage = coverage / len(charmask)
     return float(coverage)
 
 def compute_coverage(lines, entities):
     """Computes coverage of entities; expressed as ratio of characters covered; averaged over all lines"""
-    coverage = np.zeros(len(lines), dtype=np.int8)
-    for i, line in enumerate(lines):
-        coverage[i] = compute_coverage_line(line, i, entities)
-    coverage = coverage.sum()
-    if coverage: coverage = coverage / len(coverage)
-    return float(coverage)
+    if not lines:
+        return 0.0
+    return sum( compute_coverage_line(line, i, entities) for i, line in enumerate(lines) ) / len(lines)
 
 
-def findtranslations(synset_id, lang, apikey, cache=None, debug=False):
-    """Translate entity to target language (used for recall computation only now)"""
+def findtranslations(synset_id, lang, apikey, cache=None, debug=False, session=None, keypool=None, budget=None, progress=None):
+    """Translate entity to target language (used for recall computation only now). Pass a requests session to reuse its connections.
+    Raises BudgetExhausted if the translations are not cached and the budget does not allow another query, and RuntimeError if BabelNet returns any other error than a rejected key"""
+    if keypool is None: keypool = KeyPool()
+    if budget is None: budget = Budget()
+    if progress is None: progress = Progress()
     if cache is not None:
         if synset_id in cache and lang in cache[synset_id]:
+            progress.cachehit()
             for lemma in cache[synset_id][lang]:
                 yield lemma
             return
+    if session is None:
+        import requests
+        session = requests
 
-    params = {
-        'id': synset_id,
-        'filterLangs': lang.upper(),
-        'key': apikey,
-    }
-    r = requests.get("https://babelnet.io/v4/getSynset", params=params)
-    data = r.json()
+    while True:
+        key = acquirekey(keypool, budget, apikey)
+        params = {
+            'id': synset_id,
+            'filterLangs': lang.upper(),
+            'key': key,
+        }
+        progress.querystart()
+        try:
+            r = session.get("https://babelnet.io/v4/getSynset", params=params)
+        finally:
+            progress.querydone()
+        data = r.json() if r.status_code not in REJECTIONCODES else {'message': "HTTP " + str(r.status_code)}
+        if 'message' in data and 'senses' not in data:
+            #BabelNet returns a message instead of a synset when the key is invalid or its quota is reached, but also when the query itself failed
+            if r.status_code not in REJECTIONCODES and not keyrejected(str(data['message'])):
+                raise RuntimeError("BabelNet returned an error for synset " + synset_id + ": " + str(data['message']))
+            print("WARNING: API key " + redact(key) + " rejected by BabelNet (" + str(data['message']) + "), failing over to the next key",file=sys.stderr)
+            keypool.reject(key, str(data['message']))
+            continue
+        keypool.used(key, 'getsynset')
+        break
     if debug:
         print("DEBUG getsynset id="+synset_id+",filterLangs=" + lang,file=sys.stderr)
         print(json.dumps(data,indent=4, ensure_ascii=False),file=sys.stderr)
@@ -226,7 +388,214 @@ def findtranslations(synset_id, lang, apikey, cache=None, debug=False):
                     if lang not in cache[synset_id]: cache[synset_id][lang] = set()
                     cache[synset_id][lang].add(sense['lemma'])
 
-def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall, targetlang, apikey, nodup, cache=None, debug=False):
+#rough assumptions on the time a single query takes, used to estimate the duration of a run when no rate limit is set (seconds)
+BABELFY_LATENCY = 2.0
+BABELNET_LATENCY = 0.5
+
+def planqueries(lines, cache=None):
+    """Determine which BabelFy queries extraction would make for the given lines, without querying anything. Returns a dictionary with statistics and the set of synsets found in the cached results"""
+    plan = {'lines': len(lines), 'chunks': 0, 'requests': 0, 'cachehits': 0, 'requestbytes': 0, 'cachedbytes': 0, 'cachedresponsebytes': 0 }
+    synsets = set()
+    for text, _, _, _ in gettextchunks(lines, maxchunksize=4096):
+        size = len(text.encode('utf-8'))
+        plan['chunks'] += 1
+        if cache is not None and text in cache:
+            plan['cachehits'] += 1
+            plan['cachedbytes'] += size
+            plan['cachedresponsebytes'] += len(json.dumps(cache[text], ensure_ascii=False).encode('utf-8'))
+            synsets.update( entity['babelSynsetID'] for entity in cache[text] if entity['isEntity'] and 'babelSynsetID' in entity )
+        else:
+            plan['requests'] += 1
+            plan['requestbytes'] += size
+    return plan, synsets
+
+def planrun(sourcelines, targetlines, args, cache=None, sourceentities=None, keypool=None):
+    """Plan a run (dry run): reports how many BabelFy requests and BabelNet getSynset calls a real run would make, how many would be answered from the cache, the expected payload and the estimated duration.
+    If sourceentities is given (re-evaluation), no extraction is planned and the synsets are taken from them. The synsets (and so the getSynset calls) are unknown (None)
+    if there are no cached source chunks to extrapolate them from. The number of keys in the keypool (if given) is taken into account for the duration"""
+    plan = {}
+    if sourceentities is None:
+        plan['source'], synsets = planqueries(sourcelines, None if cache is None else cache['source'])
+        sides = [ plan['source'] ]
+        if targetlines:
+            plan['target'], _ = planqueries(targetlines, None if cache is None else cache['target'])
+            sides.append(plan['target'])
+        plan['requests'] = sum(side['requests'] for side in sides)
+        plan['cachehits'] = sum(side['cachehits'] for side in sides)
+        plan['requestbytes'] = sum(side['requestbytes'] for side in sides)
+        #extrapolate the response size from the cached responses
+        cachedbytes = sum(side['cachedbytes'] for side in sides)
+        plan['estimatedresponsebytes'] = int(plan['requestbytes'] * sum(side['cachedresponsebytes'] for side in sides) / cachedbytes) if cachedbytes else None
+        synsetsestimated = plan['source']['requests'] > 0
+        if synsetsestimated and plan['source']['cachehits']:
+            #synsets are only known for cached chunks, extrapolate linearly (an upper bound, as synsets recur)
+            distinctsynsets = int(round(len(synsets) * plan['source']['chunks'] / plan['source']['cachehits']))
+        elif synsetsestimated:
+            #no cached source chunks at all, so nothing to extrapolate from
+            distinctsynsets = None
+        else:
+            distinctsynsets = len(synsets)
+    else:
+        plan['requests'] = plan['cachehits'] = plan['requestbytes'] = 0
+        plan['estimatedresponsebytes'] = None
+        synsets = { entity['babelSynsetID'] for entity in sourceentities }
+        synsetsestimated = False
+        distinctsynsets = len(synsets)
+
+    plan['getsynset'] = plan['getsynsetcachehits'] = 0
+    #recall is only computed when there is something to evaluate: target lines to extract, or entities to re-evaluate
+    recall = args.recall and (bool(targetlines) or sourceentities is not None)
+    if recall and distinctsynsets is None:
+        print("WARNING: No cached source chunks to estimate the number of synsets from, the number of getSynset calls for recall is unknown and not included in the estimated duration",file=sys.stderr)
+        plan['getsynset'] = plan['getsynsetcachehits'] = None
+    elif recall:
+        synsetcache = None if cache is None else cache['synsets_target']
+        cachehits = sum( 1 for synset_id in synsets if synsetcache is not None and synset_id in synsetcache and args.targetlang in synsetcache[synset_id] )
+        checked = recallsamplesize(distinctsynsets, args.recallsample, args.recallsamplerate)
+        #assume the cache hit rate of the known synsets holds for all checked synsets
+        plan['getsynsetcachehits'] = int(round(checked * cachehits / len(synsets))) if synsets else 0
+        plan['getsynset'] = checked - plan['getsynsetcachehits']
+    plan['distinctsynsets'] = distinctsynsets
+    plan['estimated'] = synsetsestimated
+
+    getsynset = plan['getsynset'] or 0 #unknown calls are left out of the duration
+    plan['durationincludesrecall'] = plan['getsynset'] is not None
+    if args.ratelimit:
+        #the rate limit applies per key
+        plan['estimatedduration'] = (plan['requests'] + getsynset) / (args.ratelimit * max(1, len(keypool.keys) if keypool is not None else 0))
+    else:
+        plan['estimatedduration'] = plan['requests'] * BABELFY_LATENCY + getsynset * BABELNET_LATENCY
+    return plan
+
+def recallsamplesize(population, recallsample=None, recallsamplerate=None):
+    """Returns the number of synsets checked for recall out of the given number of distinct source synsets: all of them if no sample is drawn.
+    Stratification does not change this number, as allocatesample() never exceeds the sample size"""
+    if recallsample:
+        return min(recallsample, population)
+    elif recallsamplerate:
+        return min(int(math.ceil(recallsamplerate * population)), population)
+    else:
+        return population
+
+def allocatesample(sizes, samplesize):
+    """Allocate a sample over strata of the given sizes (a dictionary mapping each stratum to its number of synsets). Returns a dictionary mapping each stratum to its sample size.
+    The total never exceeds the sample size: each stratum first gets two (so it has a variance estimate), largest strata first for as long as the sample allows, the rest is allocated proportionally to the synsets not yet sampled in each stratum (largest remainder)"""
+    remaining = min(samplesize, sum(sizes.values()))
+    allocation = {}
+    for h in sorted(sizes, key=lambda h: (-sizes[h], h)):
+        allocation[h] = min(2, sizes[h], remaining)
+        remaining -= allocation[h]
+    if remaining:
+        capacity = { h: sizes[h] - allocation[h] for h in sizes }
+        quota = { h: remaining * capacity[h] / sum(capacity.values()) for h in sizes }
+        for h in sizes:
+            allocation[h] += int(quota[h])
+        left = remaining - sum( int(quota[h]) for h in sizes )
+        for h in sorted(sizes, key=lambda h: (int(quota[h]) - quota[h], h))[:left]:
+            allocation[h] += 1
+    return allocation
+
+def samplesynsets(synsetfreq, samplesize, stratify=False, rng=None):
+    """Draw a random sample of distinct synsets for recall estimation. Returns a dictionary mapping each synset to its stratum and the set of sampled synsets.
+    When stratifying, synsets are grouped by frequency band (log2 of their frequency) and the sample is allocated over the bands with allocatesample()"""
+    if rng is None: rng = random.Random()
+    if stratify:
+        stratum = { synset_id: freq.bit_length() - 1 for synset_id, freq in synsetfreq.items() }
+    else:
+        stratum = { synset_id: 0 for synset_id in synsetfreq }
+    population = defaultdict(list)
+    for synset_id in sorted(synsetfreq):
+        population[stratum[synset_id]].append(synset_id)
+    allocation = allocatesample({ h: len(members) for h, members in population.items() }, samplesize)
+    if stratify and any( n < 2 <= len(population[h]) for h, n in allocation.items() ):
+        print("WARNING: A recall sample of " + str(samplesize) + " synsets is too small to check two synsets in each of the " + str(len(population)) + " frequency bands, bands with fewer are estimated (partly) from the other bands",file=sys.stderr)
+    sampled = set()
+    for h in sorted(population):
+        sampled.update(rng.sample(population[h], allocation[h]))
+    return stratum, sampled
+
+def estimaterecall(linerecords, samplerecords, confidence=0.95, iterations=200, seed=None):
+    """Estimate macro and micro recall from a sample of synsets for which translatability was checked.
+
+    linerecords is a list of (linenr, matches, known translatable entities, {stratum: unchecked entities}) tuples, where the known
+    translatable entities include the matches, samplerecords maps each stratum to a list of (unmatched freq, translatable) tuples for the checked synsets.
+    The translatability rate of the unmatched entities in each stratum is used to impute the unchecked entities, so recall never exceeds 1,
+    per-line recall is the expected recall over the unchecked entities that may be translatable; confidence intervals are obtained by bootstrap resampling of the checked synsets within each stratum.
+    Returns per-line recall, the estimated per-line translatable entities, and a dictionary with the overall estimates."""
+    import numpy as np
+    strata = sorted({ h for _, _, _, unchecked in linerecords for h in unchecked } | set(samplerecords))
+    matches = np.array([ m for _, m, _, _ in linerecords ], dtype=np.float64)
+    known = np.array([ k for _, _, k, _ in linerecords ], dtype=np.float64)
+    unchecked = np.zeros((len(linerecords), len(strata)), dtype=np.float64)
+    for i, (_, _, _, u) in enumerate(linerecords):
+        for j, h in enumerate(strata):
+            unchecked[i,j] = u.get(h, 0)
+    sampledata = { h: (np.array([ freq for freq, _ in samplerecords.get(h,[]) ], dtype=np.float64), np.array([ freq if translatable else 0 for freq, translatable in samplerecords.get(h,[]) ], dtype=np.float64)) for h in strata }
+
+    def rates(resample=None):
+        totalfreq = totaltranslatable = 0.0
+        rate = {}
+        for h in strata:
+            freqs, translatable = sampledata[h]
+            if resample is not None and len(freqs):
+                indices = resample.randint(0, len(freqs), len(freqs))
+                freqs, translatable = freqs[indices], translatable[indices]
+            totalfreq += freqs.sum()
+            totaltranslatable += translatable.sum()
+            rate[h] = translatable.sum() / freqs.sum() if freqs.sum() else None
+        overallrate = totaltranslatable / totalfreq if totalfreq else 0.0
+        return np.array([ overallrate if rate[h] is None else rate[h] for h in strata ], dtype=np.float64)
+
+    #lines with the same matches, known and unchecked entities have the same expected recall
+    patterns = {}
+    patternindex = np.array([ patterns.setdefault((m, k, tuple(u)), len(patterns)) for m, k, u in zip(matches, known, unchecked) ], dtype=np.int64)
+
+    def expectedrecall(m, k, u, p):
+        #the expectation over the number of unchecked entities that are translatable (binomial per stratum), plugging in the
+        #expected number in the denominator instead would underestimate recall
+        pmf = np.ones(1)
+        for n, rate in zip(u, p):
+            if n:
+                n = int(n)
+                pmf = np.convolve(pmf, [ math.comb(n, x) * rate**x * (1-rate)**(n-x) for x in range(n+1) ])
+        translatable = k + np.arange(len(pmf))
+        return float(pmf.dot(np.divide(m, translatable, out=np.zeros_like(translatable), where=translatable > 0)))
+
+    def recalls(p):
+        translatable = known + unchecked.dot(p) if strata else known
+        patternrecall = np.array([ expectedrecall(m, k, u, p) for m, k, u in patterns ], dtype=np.float64)
+        linerecall = patternrecall[patternindex] if len(patternindex) else np.zeros_like(matches)
+        macro = float(linerecall.mean()) if len(linerecall) else 0.0
+        micro = float(matches.sum() / translatable.sum()) if translatable.sum() else 0.0
+        return linerecall, translatable, macro, micro
+
+    linerecall, translatable, macro, micro = recalls(rates())
+    resample = np.random.RandomState(seed)
+    macros = []
+    micros = []
+    for _ in range(iterations):
+        _, _, m, mi = recalls(rates(resample))
+        macros.append(m)
+        micros.append(mi)
+    alpha = (1 - confidence) / 2 * 100
+    estimate = {
+        'recall': macro,
+        'microrecall': micro,
+        'recall_ci': [ float(x) for x in np.percentile(macros, [alpha, 100-alpha]) ] if macros else [macro, macro],
+        'microrecall_ci': [ float(x) for x in np.percentile(micros, [alpha, 100-alpha]) ] if micros else [micro, micro],
+        'confidence': confidence,
+        'translatableentities': float(translatable.sum()),
+    }
+    return linerecall, translatable, estimate
+
+def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall, targetlang, apikey, nodup, cache=None, debug=False, recallsample=None, recallsamplerate=None, stratify=False, seed=None, firstlinenr=0, session=None, skip=None, keypool=None, budget=None, progress=None):
+    """Evaluate the source and target entities, firstlinenr is the global line number of the first of the source/target lines.
+    Lines in skip (global line numbers, e.g. lines not extracted within the budget) are left out of the evaluation. When the budget runs out during recall computation,
+    lines for which not all synsets could be checked are left out of the recall"""
+    if skip is None: skip = set()
+    if keypool is None: keypool = KeyPool()
+    if budget is None: budget = Budget()
+    if progress is None: progress = Progress()
     evaluation = {'perline':{} }
     overallprecision = []
     overallrecall = []
@@ -237,19 +606,66 @@ def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall
     alltargetsynsets = Counter()
     alltranslatableentities = Counter()
 
-    for linenr in range(0,len(sourcelines)):
+    #group entities per line
+    sourcebyline = defaultdict(list)
+    for entity in sourceentities:
+        sourcebyline[entity['linenr']].append(entity)
+    targetbyline = defaultdict(list)
+    for entity in targetentities:
+        targetbyline[entity['linenr']].append(entity)
+
+    sampled = None
+    if do_recall and (recallsample or recallsamplerate):
+        #sampled recall estimation: only check translatability for a random sample of the distinct source synsets
+        synsetfreq = Counter()
+        unmatchedfreq = Counter() #occurrences without a match in the target line, only these need to be imputed
+        for linenr in range(firstlinenr, firstlinenr + len(sourcelines)):
+            if linenr in skip: continue
+            sourcesynsets = Counter(entity['babelSynsetID'] for entity in sourcebyline[linenr])
+            matches = sourcesynsets & Counter(entity['babelSynsetID'] for entity in targetbyline[linenr])
+            if nodup:
+                sourcesynsets = Counter({ k:1 for k,v in sourcesynsets.items()})
+                matches = Counter({ k:1 for k,v in matches.items()})
+            synsetfreq += sourcesynsets
+            unmatchedfreq += sourcesynsets - matches
+        samplesize = recallsamplesize(len(synsetfreq), recallsample, recallsamplerate)
+        rng = random.Random(seed)
+        stratum, sampled = samplesynsets(synsetfreq, samplesize, stratify, rng)
+        translatable = {}
+        samplerecords = defaultdict(list)
+        progress.begin("recall (sampled synsets)", len(sampled))
+        #checked in random order, so the sample remains random if it is cut short because the budget runs out
+        for synset_id in rng.sample(sorted(sampled), len(sampled)):
+            try:
+                translatable[synset_id] = set(findtranslations(synset_id, targetlang, apikey, cache,debug, session, keypool, budget, progress))
+            except BudgetExhausted:
+                progress.advance()
+                continue
+            samplerecords[stratum[synset_id]].append( (unmatchedfreq[synset_id], len(translatable[synset_id]) > 0) )
+            progress.advance()
+        progress.end()
+        sampled = set(translatable)
+        linerecords = []
+        print("Checked translatability for a sample of " + str(len(sampled)) + " out of " + str(len(synsetfreq)) + " source synsets",file=sys.stderr)
+
+    recallskipped = 0
+    if do_recall and sampled is None:
+        progress.begin("recall", len(sourcelines))
+    for linenr in range(firstlinenr, firstlinenr + len(sourcelines)):
+        if linenr in skip:
+            if do_recall and sampled is None:
+                progress.advance()
+            continue
         #check for each synset ID whether it is present in the target sentence
         sourcesynsets = Counter()
         targetsynsets = Counter()
         synset2text = defaultdict(list) #synset => text
-        for entity in sourceentities:
-            if entity['linenr'] == linenr:
-                sourcesynsets[entity['babelSynsetID']] += 1
-                if do_recall:
-                    synset2text[entity['babelSynsetID']].append(entity['text'])
-        for entity in targetentities:
-            if entity['linenr'] == linenr:
-                targetsynsets[entity['babelSynsetID']] += 1
+        for entity in sourcebyline[linenr]:
+            sourcesynsets[entity['babelSynsetID']] += 1
+            if do_recall:
+                synset2text[entity['babelSynsetID']].append(entity['text'])
+        for entity in targetbyline[linenr]:
+            targetsynsets[entity['babelSynsetID']] += 1
         matches = sourcesynsets & targetsynsets #intersection
 
         if nodup:
@@ -265,13 +681,13 @@ def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall
         # example: 684 bn:00019586n classroom Klassenraum
         for match, freq in matches.items():
             sourcetext = "{?}"
-            for entity in sourceentities:
-                if entity['linenr'] == linenr and entity['babelSynsetID'] == match:
+            for entity in sourcebyline[linenr]:
+                if entity['babelSynsetID'] == match:
                     sourcetext = entity['text']
                     break
             targettext = "{?}"
-            for entity in targetentities:
-                if entity['linenr'] == linenr and entity['babelSynsetID'] == match:
+            for entity in targetbyline[linenr]:
+                if entity['babelSynsetID'] == match:
                     targettext = entity['text']
                     break
             print("@" + str(linenr) + "\t" + match + "\t" + sourcetext + "\t" + targettext + "\t" + str(freq), file=sys.stderr)
@@ -286,7 +702,7 @@ def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall
             precision = sum(matches.values())/sum(targetsynsets.values())
             overallprecision.append(precision)
             evaluation['perline'][linenr]['precision'] = precision
-            coverage = compute_coverage_line(targetlines[linenr], linenr, targetentities)
+            coverage = compute_coverage_line(targetlines[linenr - firstlinenr], linenr, targetbyline[linenr])
             evaluation['perline'][linenr]['targetcoverage'] = coverage
             overalltargetcoverage.append(coverage)
         else:
@@ -294,24 +710,44 @@ def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall
             overalltargetcoverage.append(0.0)
             overallprecision.append(0.0)
 
-        if do_recall:
+        if do_recall and sampled is not None:
+            #matched entities are translatable by definition, of the unmatched ones only the sampled synsets have been checked,
+            #the others are estimated afterwards
+            known = sum(matches.values())
+            unchecked = Counter()
+            for synset_id, freq in (sourcesynsets - matches).items():
+                if synset_id in sampled:
+                    if translatable[synset_id]:
+                        known += freq
+                        if synset_id not in matches:
+                            print("!" + str(linenr) + "\tMISSED\t"+synset_id+"\t" + ";".join(synset2text[synset_id]) + "\t" + ";".join(translatable[synset_id]) + "\t" + str(freq), file=sys.stderr)
+                else:
+                    unchecked[stratum[synset_id]] += freq
+            linerecords.append( (linenr, sum(matches.values()), known, unchecked) )
+        elif do_recall:
             #compute how many of the source synsets have corresponding translations in the target language
             #this creates a hypothetical upper bound for recall computation
             #(will query babel.net extensively, hence optional!)
             #print("\tL" + str(linenr+1) + " - Computing recall...",end="", file=sys.stderr)
             translatableentities = Counter()
             translations = {}
-            for synset_id, freq in sourcesynsets.items():
-                targetlemmas = set(findtranslations(synset_id, targetlang, apikey, cache,debug))
-                if len(targetlemmas) > 0:
-                    #we have a link
-                    translatableentities[synset_id] += freq
-                    translations[synset_id] = targetlemmas
-                    if synset_id not in matches:
-                        print("!" + str(linenr) + "\tMISSED\t"+synset_id+"\t" + ";".join(synset2text[synset_id]) + "\t" + ";".join(translations[synset_id]) + "\t" + str(freq), file=sys.stderr)
+            try:
+                for synset_id, freq in sourcesynsets.items():
+                    targetlemmas = set(findtranslations(synset_id, targetlang, apikey, cache,debug, session, keypool, budget, progress))
+                    if len(targetlemmas) > 0:
+                        #we have a link
+                        translatableentities[synset_id] += freq
+                        translations[synset_id] = targetlemmas
+                        if synset_id not in matches:
+                            print("!" + str(linenr) + "\tMISSED\t"+synset_id+"\t" + ";".join(synset2text[synset_id]) + "\t" + ";".join(translations[synset_id]) + "\t" + str(freq), file=sys.stderr)
+            except BudgetExhausted:
+                translatableentities = None
             #print(sum(translatableentities.values()),file=sys.stderr)
 
-            if translatableentities:
+            if translatableentities is None:
+                #the budget ran out before all synsets on this line were checked
+                recallskipped += 1
+            elif translatableentities:
                 recall = sum(matches.values())/sum(translatableentities.values())
                 overallrecall.append(recall)
                 evaluation['perline'][linenr]['recall'] = recall
@@ -322,13 +758,17 @@ def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall
                 overallrecall.append(0.0)
 
         if sourcesynsets:
-            coverage = compute_coverage_line(sourcelines[linenr], linenr, sourceentities)
+            coverage = compute_coverage_line(sourcelines[linenr - firstlinenr], linenr, sourcebyline[linenr])
             evaluation['perline'][linenr]['sourcecoverage'] = coverage
             overallsourcecoverage.append(coverage)
         else:
             evaluation['perline'][linenr]['sourcecoverage'] = 0.0
             overallsourcecoverage.append(0.0)
 
+        if do_recall and sampled is None:
+            progress.advance()
+    if do_recall and sampled is None:
+        progress.end()
 
     #macro averages of precision and recall
     if overallprecision:
@@ -359,18 +799,38 @@ def evaluate(sourceentities, targetentities, sourcelines, targetlines, do_recall
     else:
         evaluation['microrecall'] = 0
     evaluation['translatableentities'] = sum(alltranslatableentities.values()) #macro
+    if do_recall and sampled is not None:
+        linerecall, linetranslatable, estimate = estimaterecall(linerecords, samplerecords, seed=seed)
+        for (linenr, _, _, _), recall, translatableentities in zip(linerecords, linerecall, linetranslatable):
+            evaluation['perline'][linenr]['recall'] = float(recall)
+            if translatableentities:
+                evaluation['perline'][linenr]['translatableentities'] = float(translatableentities)
+        evaluation['recall'] = estimate['recall']
+        evaluation['microrecall'] = estimate['microrecall']
+        evaluation['translatableentities'] = estimate['translatableentities']
+        estimate['sampledsynsets'] = len(sampled)
+        estimate['totalsynsets'] = len(stratum)
+        estimate['stratified'] = stratify
+        estimate['seed'] = seed
+        evaluation['recallestimate'] = estimate
     evaluation['matches'] = sum(allmatches.values())  #macro
+    if skip or budget.limited() or budget.exhausted():
+        evaluation['coverage'] = {'lines': len(sourcelines), 'evaluatedlines': len(sourcelines) - len(skip & set(range(firstlinenr, firstlinenr + len(sourcelines)))) }
+        if do_recall:
+            evaluation['coverage']['recalllines'] = evaluation['coverage']['evaluatedlines'] - recallskipped
     print( "lines:" + str(len(sourcelines)), file=sys.stderr)
     return evaluation
 
-def processfolia(doc, args, cache):
-    doc.processor = folia.Processor.create(name="babelente", version=VERSION)
-    doc.provenance.append(doc.processor)
-    doc.declare(folia.Entity, set=args.foliaset, processor=doc.processor)
-    doc.declare(folia.Relation, set=args.foliarelationset, processor=doc.processor)
-    doc.declare(folia.Metric, set=args.foliametricset, processor=doc.processor)
+def processfolia(doc, args, cache, lang=None, clients=None, keypool=None, budget=None, progress=None):
+    """Extract entities from a FoLiA document and add them to it, returns the entities"""
+    data = foliatexts(doc)
+    entities = [ dict(entity) for  entity in findentities([x[2] for x in data], lang or args.sourcelang, args, None if cache is None else cache['source'], clients=clients, keypool=keypool, budget=budget, progress=progress) if entity['isEntity'] and 'babelSynsetID' in entity ] #with sanity check
+    addfoliaentities(doc, data, entities, args)
+    return entities
 
-    processed = set()
+def foliatexts(doc):
+    """Collect the texts to extract entities from in a FoLiA document, returns a list of (structural element, words, text) tuples"""
+    from folia import main as folia
     data = []
     for word in doc.words():
         parent = word.ancestor(folia.AbstractStructureElement)
@@ -378,10 +838,17 @@ def processfolia(doc, args, cache):
             parent._babelente_processed = True
             words = list(parent.select(folia.Word))
             data.append( (parent, words, " ".join([ str(word) for word in words]) ) )
+    return data
 
-    entities = [ entity for  entity in findentities([x[2] for x in data], args.sourcelang, args, None if cache is None else cache['source']) if entity['isEntity'] and 'babelSynsetID' in entity ] #with sanity check
+def addfoliaentities(doc, data, entities, args):
+    """Add the entities found in the texts collected by foliatexts() to the FoLiA document"""
+    from folia import main as folia
+    doc.processor = folia.Processor.create(name="babelente", version=VERSION)
+    doc.provenance.append(doc.processor)
+    doc.declare(folia.Entity, set=args.foliaset, processor=doc.processor)
+    doc.declare(folia.Relation, set=args.foliarelationset, processor=doc.processor)
+    doc.declare(folia.Metric, set=args.foliametricset, processor=doc.processor)
 
-    #add entities to the FoLiA document
     for entity in entities:
         linenr = entity['linenr']
         parent, words, text = data[linenr]
@@ -392,7 +859,6 @@ def processfolia(doc, args, cache):
         entity['spantext'] = [ str(word) for word in span ]
         entity['docfile'] = doc.filename
         entity['docid'] = doc.id
-        print(entity, ",")
 
         foliaentity = parent.add(folia.Entity, *span, set=args.foliaset, cls=entity['babelSynsetID'].replace('bn:',''), generate_id_in=parent, confidence=float(entity['score']))
         foliaentity.add(folia.Description, value=entity['text'])
@@ -405,18 +871,406 @@ def processfolia(doc, args, cache):
             relation = foliaentity.add(folia.Relation, cls="babelnet", href=entity['BabelNetURL'], set=args.foliarelationset, format="application/rdf+xml")
             relation.add(folia.LinkReference, id=entity['BabelNetURL'])
 
+def foliaoutputname(filename):
+    """Returns the name of the enriched FoLiA document for an input document"""
+    outputname = os.path.basename(filename)
+    if outputname.endswith('.folia.xml'):
+        return outputname.replace('.folia.xml','.babelente.folia.xml')
+    elif outputname.endswith('.xml'):
+        return outputname.replace('.xml','.babelente.folia.xml')
+    else:
+        return outputname + '.babelente.folia.xml'
+
 def stripmultispace(line):
     line = line.strip()
     return " ".join([ w for w in line.split(" ") if w ])
 
+def readlinerange(filename, firstline, lastline, index=None):
+    """Read a range of lines (lastline inclusive) from a plain text file, using its line-offset index"""
+    if index is None:
+        index = loadlineindex(filename)
+    lastline = min(lastline, linecount(index) - 1)
+    if lastline < firstline:
+        return []
+    with open(filename, 'rb') as f:
+        f.seek(int(index[firstline]))
+        data = f.read(int(index[lastline+1]) - int(index[firstline]))
+    return [ stripmultispace(line) for line in data.decode('utf-8').split("\n")[:lastline - firstline + 1] ]
+
+def parselinerange(spec, count):
+    """Parse a START:END line range specification (0-indexed, END exclusive, either may be omitted) for a file with the specified number of lines. Returns a (firstline, lastline) tuple with lastline exclusive"""
+    if ':' not in spec:
+        raise ValueError("Line range must be of the form START:END")
+    start, end = spec.split(':',1)
+    start = int(start) if start else 0
+    end = min(int(end), count) if end else count
+    if start < 0 or start > end:
+        raise ValueError("Invalid line range " + spec + " for " + str(count) + " lines")
+    return start, end
+
+def loadcache(filename):
+    if filename:
+        if os.path.exists(filename):
+            print("Loading cache from " + filename,file=sys.stderr)
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        else:
+            print("Creating new cache " + filename,file=sys.stderr)
+            return newcache()
+    return None
+
+def newcache():
+    return {'source':{}, 'target': {}, 'synsets_source': {}, 'synsets_target': {}}
+
+def mergecache(cache, other):
+    """Merge the entries of another cache into the cache"""
+    for part in ('source', 'target'):
+        for text, entities in other[part].items():
+            cache[part].setdefault(text, entities)
+    for part in ('synsets_source', 'synsets_target'):
+        for synset_id, translations in other[part].items():
+            for lang, lemmas in translations.items():
+                cache[part].setdefault(synset_id, {}).setdefault(lang, set()).update(lemmas)
+
+def reportlinkers(linkers):
+    """Output statistics for the local linkers to stderr, returns them as a dictionary"""
+    stats = {}
+    for side, linker in sorted(linkers.items()):
+        if linker is not None:
+            stats[side] = linker.stats()
+            print("LOCALLINKER(" + side + "): RESOLVEDLINES=" + str(stats[side]['resolvedlines']), "DEFERREDLINES=" + str(stats[side]['deferredlines']), "AVOIDEDREQUESTS=" + str(stats[side]['avoidedrequests']), "AVOIDEDBYTES=" + str(stats[side]['avoidedbytes']), file=sys.stderr)
+    return stats
+
+def reportkeys(keypool):
+    """Output the usage per API key in the pool to stderr"""
+    if len(keypool.keys) > 1 or keypool.rejected:
+        for key, usage in keypool.report().items():
+            print("APIKEY(" + key + "): BABELFY=" + str(usage['babelfy']), "GETSYNSET=" + str(usage['getsynset']), "REJECTED=" + str(usage['rejected']), file=sys.stderr)
+
+def reportcoverage(budget, skipped, firstlinenr, linecount, sides):
+    """Output the coverage of a run bounded by the budget (a deadline or a maximum number of requests) or stopped because no usable API keys remain to stderr, returns it as a dictionary"""
+    coverage = budget.report()
+    print("BUDGET: STOPPED=" + str(coverage['stopped']), "REQUESTS=" + str(coverage['requests']), "ELAPSED=" + str(round(coverage['elapsed'])) + "s", file=sys.stderr)
+    for side in sides:
+        coverage[side] = {
+            'lines': linecount,
+            'processedlines': linecount - len(skipped[side]),
+            'processed': complementranges(skipped[side], firstlinenr, firstlinenr + linecount),
+            'skipped': lineranges(skipped[side]),
+        }
+        print("COVERAGE(" + side + ")=" + str(coverage[side]['processedlines']) + "/" + str(linecount), file=sys.stderr)
+    return coverage
+
+def savecache(filename, cache, shared=False):
+    """Save the cache. A shared cache may be saved by multiple processes: the cache on disk is merged in first (under a lock) so entries others added in the meantime are kept"""
+    if cache is not None:
+        if not shared:
+            with open(filename,'wb') as f:
+                pickle.dump(cache,f)
+            return
+        with open(filename + ".lock", 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(filename):
+                    with open(filename, 'rb') as f:
+                        mergecache(cache, pickle.load(f))
+                #replaced atomically, so processes loading the cache never see a partial file
+                tmpfilename = filename + "." + str(os.getpid()) + ".tmp"
+                with open(tmpfilename,'wb') as f:
+                    pickle.dump(cache,f)
+                os.replace(tmpfilename, filename)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+FOLIASET = "https://raw.githubusercontent.com/proycon/babelente/master/setdefinitions/babelente.babelnet.ttl"
+FOLIARELATIONSET = "https://raw.githubusercontent.com/proycon/babelente/master/setdefinitions/babelente.relations.ttl"
+FOLIAMETRICSET = "https://raw.githubusercontent.com/proycon/babelente/master/setdefinitions/babelente.metrics.ttl"
+
+#options of the engine and their defaults (the same as those of the command line tool)
+ENGINEOPTIONS = {
+    'sourcelang': "EN",
+    'cands': None,
+    'anntype': None,
+    'annres': None,
+    'th': None,
+    'match': None,
+    'mcs': None,
+    'dens': False,
+    'extaida': False,
+    'postag': None,
+    'overlap': 'allow',
+    'locallinker': False,
+    'locallinkerthreshold': 0.95,
+    'locallinkerminsupport': 5,
+    'dryrun': False,
+    'debug': False,
+    'foliaset': FOLIASET,
+    'foliarelationset': FOLIARELATIONSET,
+    'foliametricset': FOLIAMETRICSET,
+}
+
+class BabelEnte:
+    """Entity extraction and evaluation engine for use from Python.
+
+    The engine holds the BabelFy parameters, the BabelFy clients and HTTP session (so connections stay warm) and the
+    cache, all of which are reused over multiple calls. Options are the same as the long command line options (see
+    ENGINEOPTIONS). Pass an existing cache (as loaded from a cache file) to reuse it, cache=False disables caching.
+    Each engine has its own key pool, budget and progress, unless existing ones are passed to share them"""
+
+    def __init__(self, apikey=None, apikeys=(), cache=None, ratelimit=None, keypool=None, budget=None, progress=None, **options):
+        for key in options:
+            if key not in ENGINEOPTIONS:
+                raise TypeError("Unknown option for BabelEnte: " + key)
+        self.args = argparse.Namespace(**dict(ENGINEOPTIONS, **options))
+        self.args.apikey = apikey or ""
+        self.keypool = keypool if keypool is not None else KeyPool()
+        if ratelimit is not None:
+            self.keypool.setrate(ratelimit)
+        for key in ([apikey] if apikey else []) + list(apikeys):
+            self.keypool.add(key)
+        self.budget = budget if budget is not None else Budget()
+        self.progress = progress if progress is not None else Progress()
+        if cache is None:
+            cache = newcache()
+        self.cache = cache if cache is not False else None
+        self.clients = {} #BabelFy client per API key
+        self.session = None #HTTP session for BabelNet, created when first needed
+        self.linkers = {} #side => local linker, built on first use
+
+    @staticmethod
+    def fromargs(args, cache=None, keypool=None, budget=None, progress=None):
+        """Create an engine from parsed command line arguments (the API keys are expected to be in the key pool already)"""
+        engine = BabelEnte(cache=cache if cache is not None else False, keypool=keypool, budget=budget, progress=progress, **{ key: getattr(args, key) for key in ENGINEOPTIONS })
+        engine.args.apikey = args.apikey
+        return engine
+
+    def linker(self, side):
+        """Returns the local linker for the source or target side, it is built from the cache on first use"""
+        if side not in self.linkers:
+            print("Building local linker for " + side + " from cache...",file=sys.stderr)
+            self.linkers[side] = LocalLinker.fromcache(self.cache[side], self.args.locallinkerthreshold, self.args.locallinkerminsupport)
+        return self.linkers[side]
+
+    def extract(self, lines, lang, side='source', firstlinenr=0, skipped=None, boundaries=()):
+        """Extract entities from the lines, yields entities (dictionaries in BabelFy's format, extended with linenr and offset).
+        Line numbers are offset by firstlinenr so they can be made global. The side ('source' or 'target') selects the part of the cache to use.
+        A new chunk is started at each of the (relative) line numbers in boundaries, so the lines on either side are never queried together.
+        If the budget runs out, the remaining lines that need querying are skipped; their line numbers are added to the skipped set (if passed) once all entities have been yielded"""
+        lines = [ stripmultispace(line) for line in lines ]
+        cache = None if self.cache is None else self.cache[side]
+        skippedlines = set()
+        if self.args.locallinker and cache is not None:
+            entities = linkentities(lines, lang, self.args, self.linker(side), cache, self.clients, skippedlines, self.keypool, self.budget, self.progress, boundaries)
+        else:
+            entities = findentities(lines, lang, self.args, cache, clients=self.clients, skipped=skippedlines, keypool=self.keypool, budget=self.budget, progress=self.progress, boundaries=boundaries)
+        for entity in entities:
+            if entity['isEntity'] and 'babelSynsetID' in entity: #sanity check
+                #copy, as the entities may be shared with the cache (and so with the results of other calls)
+                yield dict(entity, linenr=entity['linenr'] + firstlinenr)
+        if skipped is not None:
+            skipped.update( linenr + firstlinenr for linenr in skippedlines )
+
+    def extract_parallel(self, sourcelines, targetlines, sourcelang, targetlang, firstlinenr=0, skipped=None):
+        """Extract entities from parallel source and target lines, returns a (source entities, target entities) tuple (see extract()).
+        The chunks of both sides are processed alternately in the order of their first line (the chunks themselves are the same as with extract()), so if the budget runs out,
+        both sides have been processed up to about the same line and those lines can still be evaluated. The line numbers of skipped lines are added to skipped ({side: set}, if passed)"""
+        lines = {}
+        chunks = [] #(first line, side number, side, chunk) tuples
+        entities = {'source': [], 'target': []}
+        skippedlines = {'source': set(), 'target': set()}
+        for sidenr, (side, sidelines) in enumerate((('source', sourcelines), ('target', targetlines))):
+            lines[side] = [ stripmultispace(line) for line in sidelines ]
+            cache = None if self.cache is None else self.cache[side]
+            if self.args.locallinker and cache is not None:
+                entities[side], sidechunks = linkchunks(lines[side], self.args, self.linker(side), cache)
+            else:
+                sidechunks = gettextchunks(lines[side], maxchunksize=4096)
+            chunks += [ (chunk[1], sidenr, side, chunk) for chunk in sidechunks ]
+        chunks.sort(key=lambda x: x[:2])
+        babelfy_params = {'source': babelfyparams(self.args, sourcelang), 'target': babelfyparams(self.args, targetlang)}
+        self.progress.begin("extraction (" + sourcelang.lower() + "," + targetlang.lower() + ")", sum(len(chunk[3]) for _, _, _, chunk in chunks))
+        for i, (_, _, side, chunk) in enumerate(chunks):
+            cache = None if self.cache is None else self.cache[side]
+            #copied right away: the entities may be shared with the cache, so a later chunk with the same text would overwrite their line numbers
+            entities[side] += [ dict(entity) for entity in findchunkentities(i, chunk, lines[side], babelfy_params[side], self.args, cache, self.clients, skippedlines[side], self.keypool, self.budget, self.progress) ]
+        self.progress.end()
+        for side in entities:
+            entities[side].sort(key=lambda entity: entity['linenr'])
+            entities[side] = [ dict(entity, linenr=entity['linenr'] + firstlinenr) for entity in entities[side] if entity['isEntity'] and 'babelSynsetID' in entity ]
+            if skipped is not None:
+                skipped[side].update( linenr + firstlinenr for linenr in skippedlines[side] )
+        return entities['source'], entities['target']
+
+    def extract_batch(self, inputs, lang, side='source'):
+        """Extract entities from multiple inputs in one go, as a single extraction phase. Each input is chunked separately, so its queries (and cache entries) are the same
+        as when it is extracted by itself, regardless of the other inputs in the batch.
+        Each input is either a list (or tuple) of lines or a FoLiA document (to which the entities are added). Returns a list with the entities of each input, line numbers are relative to the input"""
+        lines = []
+        firstlinenrs = [] #first line of each input
+        foliadata = {}
+        for i, inputdata in enumerate(inputs):
+            firstlinenrs.append(len(lines))
+            if isinstance(inputdata, (list, tuple)):
+                lines += inputdata
+            else:
+                foliadata[i] = foliatexts(inputdata)
+                lines += [ text for _, _, text in foliadata[i] ]
+        results = [ [] for _ in inputs ]
+        for entity in self.extract(lines, lang, side, boundaries=set(firstlinenrs)):
+            i = bisect.bisect_right(firstlinenrs, entity['linenr']) - 1
+            entity['linenr'] -= firstlinenrs[i]
+            results[i].append(entity)
+        for i, data in foliadata.items():
+            addfoliaentities(inputs[i], data, results[i], self.args)
+        return results
+
+    def evaluate(self, sourceentities, targetentities, sourcelines, targetlines, targetlang, recall=False, nodup=False, recallsample=None, recallsamplerate=None, stratify=False, seed=None, firstlinenr=0, skip=None):
+        """Evaluate the source and target entities (see evaluate()), returns the evaluation as a dictionary"""
+        if recall and self.session is None:
+            import requests
+            self.session = requests.Session()
+        return evaluate(sourceentities, targetentities, sourcelines, targetlines, recall, targetlang, self.args.apikey, nodup, None if self.cache is None else self.cache['synsets_target'], self.args.debug, recallsample, recallsamplerate, stratify, seed, firstlinenr, self.session, skip, self.keypool, self.budget, self.progress)
+
+    def annotate_folia(self, doc, lang=None):
+        """Extract entities from a FoLiA document (in the source language unless lang is specified) and add them to it, returns the entities"""
+        return processfolia(doc, self.args, self.cache, lang, self.clients, self.keypool, self.budget, self.progress)
+
+#parameters a coordinator passes on to the workers through the work queue
+JOBPARAMS = ('source','target','sourcelang','targetlang','cands','anntype','annres','th','match','mcs','dens','extaida','postag','overlap','stale','locallinker','locallinkerthreshold','locallinkerminsupport')
+
+def jobfingerprint(args, sourcelinecount, targetlinecount, firstlinenr=0):
+    """Identifies the job a queue was published for: the job parameters, the input files (path, size and modification time) and the line range.
+    A coordinator only resumes a published job if its fingerprint is the same"""
+    fingerprint = { key: getattr(args, key) for key in JOBPARAMS }
+    fingerprint['files'] = {}
+    for side, filename in (('source', args.source), ('target', args.target)):
+        if filename:
+            fingerprint[side] = os.path.abspath(filename)
+            stat = os.stat(filename)
+            fingerprint['files'][side] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    fingerprint['firstlinenr'] = firstlinenr
+    fingerprint['linecount'] = {'source': sourcelinecount, 'target': targetlinecount if args.target else 0}
+    return fingerprint
+
+def runcoordinator(args, sourcelinecount, targetlinecount, firstlinenr=0, skipped=None, budget=None, progress=None):
+    """Publish the source and target files as line-range shards in the work queue, wait for the workers to process them all, and reassemble the entities (with global line numbers).
+    When the deadline passes, the pending shards are cancelled and only the shards in progress are waited for. The lines that were not processed are added to skipped ({side: set})"""
+    from babelente.workqueue import WorkQueue, makeshards, PENDING, CLAIMED, DONE, CANCELLED
+    if budget is None: budget = Budget()
+    if progress is None: progress = Progress()
+    queue = WorkQueue(args.queue)
+    params = jobfingerprint(args, sourcelinecount, targetlinecount, firstlinenr)
+    published = queue.params() if queue.published() else None
+    if published is not None and published != params and not args.reset:
+        differences = sorted( key for key in set(params) | set(published) if params.get(key) != published.get(key) )
+        print("ERROR: Queue " + args.queue + " holds a different job (differs in: " + ", ".join(differences) + "), use --reset to discard it and publish this job",file=sys.stderr)
+        sys.exit(2)
+    if published is not None and not args.reset:
+        print("Resuming job already published in queue " + args.queue,file=sys.stderr)
+        queue.uncancel() #shards cancelled by an earlier deadline get another chance
+    else:
+        if published is not None:
+            print("Discarding job previously published in queue " + args.queue,file=sys.stderr)
+        #make sure the line-offset indices exist before any worker needs them
+        loadlineindex(params['source'])
+        shards = makeshards('source', sourcelinecount, args.shardsize, firstlinenr)
+        if args.target:
+            loadlineindex(params['target'])
+            shards += makeshards('target', targetlinecount, args.shardsize, firstlinenr)
+            #shards are claimed in order, alternate source and target so a deadline leaves both sides covering the same lines
+            shards.sort(key=lambda shard: (shard[1], shard[0] != 'source'))
+        queue.publish(params, shards)
+        print("Published " + str(len(shards)) + " shards in queue " + args.queue + ", start workers with: babelente --worker --queue " + args.queue + " -k YOUR-API-KEY",file=sys.stderr)
+    progress.begin("extraction (distributed shards)", sum(queue.status().values()))
+    while True:
+        reclaimed = queue.reclaim(args.stale)
+        if reclaimed:
+            print("Reclaimed " + str(reclaimed) + " shard(s) from unresponsive workers",file=sys.stderr)
+        if budget.exhausted():
+            cancelled = queue.cancel()
+            if cancelled:
+                print("Budget exhausted (" + budget.exhausted() + "), cancelled " + str(cancelled) + " pending shard(s), waiting for the shards in progress",file=sys.stderr)
+        status = queue.status()
+        progress.done = status[DONE] + status[CANCELLED]
+        progress.inflight = status[CLAIMED]
+        progress.report()
+        if not status[PENDING] and not status[CLAIMED]:
+            break
+        print("Waiting for workers: " + str(status[PENDING]) + " pending, " + str(status[CLAIMED]) + " in progress, " + str(status[DONE]) + " done",file=sys.stderr)
+        time.sleep(args.poll)
+    progress.end()
+    entities = {'source': [], 'target': []}
+    for side in entities:
+        for _, _, result in queue.results(side):
+            entities[side] += result['entities']
+            if skipped is not None: skipped[side].update(result['skipped'])
+        if skipped is not None:
+            for firstline, lastline in queue.cancelled(side):
+                skipped[side].update(range(firstline, lastline+1))
+    queue.close()
+    return entities['source'], entities['target']
+
+def runworker(args, cache=None, keypool=None, budget=None, progress=None):
+    """Claim shards from the work queue and extract the entities from them until all shards are processed"""
+    from babelente.workqueue import WorkQueue, Heartbeat, workerid, PENDING, CLAIMED
+    queue = WorkQueue(args.queue)
+    params = queue.params()
+    if params is None:
+        print("ERROR: No job has been published in queue " + args.queue + " (start a --coordinator first)",file=sys.stderr)
+        sys.exit(2)
+    for key in JOBPARAMS:
+        setattr(args, key, params[key])
+    worker = workerid()
+    processed = 0
+    indices = {}
+    engine = BabelEnte.fromargs(args, cache, keypool, budget, progress)
+    while True:
+        if engine.budget.exhausted():
+            print("Worker " + worker + " stops claiming shards, budget exhausted (" + engine.budget.exhausted() + ")",file=sys.stderr)
+            break
+        shard = queue.claim(worker)
+        if shard is None:
+            queue.reclaim(args.stale)
+            status = queue.status()
+            if not status[PENDING] and not status[CLAIMED]:
+                break
+            time.sleep(args.poll) #other workers are still busy, their shards may still be reclaimed
+            continue
+        shard_id, side, firstline, lastline = shard
+        print("Worker " + worker + " processing " + side + " shard #" + str(shard_id) + " (lines " + str(firstline) + "-" + str(lastline) + ")",file=sys.stderr)
+        heartbeat = Heartbeat(queue, shard_id, worker, max(1, args.stale / 4))
+        heartbeat.start()
+        try:
+            filename = args.source if side == 'source' else args.target
+            if filename not in indices:
+                indices[filename] = loadlineindex(filename)
+            lines = readlinerange(filename, firstline, lastline, indices[filename])
+            lang = args.sourcelang if side == 'source' else args.targetlang
+            skipped = set()
+            entities = list(engine.extract(lines, lang, side, firstline, skipped))
+        finally:
+            heartbeat.stop()
+        if queue.complete(shard_id, worker, {'entities': entities, 'skipped': sorted(skipped)}):
+            processed += 1
+        else:
+            print("NOTICE: Shard #" + str(shard_id) + " was reclaimed by another worker in the meantime; discarding result",file=sys.stderr)
+    queue.close()
+    print("Worker " + worker + " finished, processed " + str(processed) + " shard(s)",file=sys.stderr)
+    reportlinkers(engine.linkers)
+
 def main():
     parser = argparse.ArgumentParser(description="BabelEnte: Entity extractioN, Translation and Evaluation using BabelFy", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-k','--apikey','--key', type=str,help="Babelnet API key", action='store',default="",required=False)
+    parser.add_argument('--apikeyfile', type=str,help="File with Babelnet API keys (one per line), queries are distributed over all keys (along with --apikey and the keys in the environment variable BABELNET_API_KEYS, comma separated), rejected keys (e.g. quota reached) are failed over", action='store',required=False)
     parser.add_argument('-s','--sourcelang', type=str,help="Source language code", action='store',default="EN",required=False)
     parser.add_argument('-t','--targetlang', type=str,help="Target language code", action='store',default="",required=False)
     parser.add_argument('-S','--source', type=str,help="Source sentences (plain text, one per line, utf-8)", action='store',default="",required=False)
     parser.add_argument('-T','--target', type=str,help="Target sentences (plain text, one per line, utf-8)", action='store',default="",required=False)
     parser.add_argument('-r', '--recall',help="Compute recall as well using Babel.net (results in many extra queries!)", action='store_true',required=False)
+    parser.add_argument('--recall-sample', dest='recallsample', type=int,help="Estimate recall by checking translatability for a random sample of this many distinct source synsets only (implies --recall)", action='store',required=False)
+    parser.add_argument('--recall-sample-rate', dest='recallsamplerate', type=float,help="Estimate recall by checking translatability for a random sample of this proportion (0-1) of the distinct source synsets only (implies --recall)", action='store',required=False)
+    parser.add_argument('--recall-stratify', dest='recallstratify', help="Stratify the recall sample by synset frequency", action='store_true',required=False)
+    parser.add_argument('--seed', type=int,help="Random seed, makes recall sampling reproducible", action='store',required=False)
     parser.add_argument('-o', '--outputdir',type=str,help="Output directory when processing FoLiA documents (set to /dev/null to skip output alltogether)", action='store',default="./", required=False)
     parser.add_argument('-d', '--debug',help="Debug", action='store_true',required=False)
     parser.add_argument('--nodup', help="Filter out duplicate entities in evaluation", action='store_true',required=False)
@@ -431,16 +1285,33 @@ def main():
     parser.add_argument('--postag', type=str,help="Use this parameter to change the tokenization and pos-tagging pipeline for your input text. Values: STANDARD, NOMINALIZE_ADJECTIVES, INPUT_FRAGMENTS_AS_NOUNS, CHAR_BASED_TOKENIZATION_ALL_NOUN", action='store',required=False)
     parser.add_argument('--extaida', help="Extend the candidates sets with the aida_means relations from YAGO.", action='store_true',required=False)
     parser.add_argument('--overlap',type=str, help="Resolve overlapping entities, can be set to allow (default), longest, score, globalscore, coherencescore", action='store',default='allow',required=False)
-    parser.add_argument('--cache',type=str, help="Cache file, stores queries to prevent excessive querying of BabelFy (warning: not suitable for parallel usage!)", action='store',required=False)
-    parser.add_argument('--dryrun', help="Do not query", action='store_true',required=False)
+    parser.add_argument('--cache',type=str, help="Cache file, stores queries to prevent excessive querying of BabelFy (warning: not suitable for parallel usage, unless --sharedcache is set!)", action='store',required=False)
+    parser.add_argument('--sharedcache', help="The cache file (--cache) is shared by multiple processes that may run at the same time: merge the cache on disk when saving, under a lock, rather than overwriting it", action='store_true',required=False)
+    parser.add_argument('--dryrun', help="Do not query, but plan the run: report how many BabelFy and BabelNet queries a real run would make, how many would be answered from the cache (--cache), the expected payload size and estimated duration", action='store_true',required=False)
+    parser.add_argument('--ratelimit', type=float, help="Maximum number of queries per second to BabelFy/BabelNet, per API key", action='store',required=False)
+    parser.add_argument('--deadline',type=float, help="Stop issuing new queries to BabelFy/BabelNet after this many seconds; queries underway are finished and output is produced for the lines processed so far (see the coverage field in the output), metrics are computed over the processed lines only", action='store',required=False)
+    parser.add_argument('--max-requests',dest='maxrequests',type=int, help="Stop issuing new queries after this many queries to BabelFy/BabelNet (together), like --deadline", action='store',required=False)
+    parser.add_argument('--progress',type=str, help="Write the progress (lines processed, queries per second, cache hit rate, ETA) as JSON to this file during extraction and recall computation", action='store',required=False)
+    parser.add_argument('--progressinterval',type=float, help="Minimum interval in seconds between progress updates", action='store',default=2.0,required=False)
+    parser.add_argument('--locallinker', help="Resolve lines locally where possible, using a lexicon of the surface forms linked in the cached BabelFy results (requires --cache); only lines that can not be resolved with confidence are sent to BabelFy", action='store_true',required=False)
+    parser.add_argument('--locallinkerthreshold', type=float, help="Minimum confidence (ratio of occurrences linked to the same synset) for the local linker to link a surface form", action='store',default=0.95,required=False)
+    parser.add_argument('--locallinkerminsupport', type=int, help="Minimum number of occurrences of a surface form in the cached texts for the local linker to link it, and of any other word (without a link) for the local linker to leave it unlinked", action='store',default=5,required=False)
+    parser.add_argument('--lines',type=str, help="Only process this range of lines from the source/target files, formatted as START:END (0-indexed, END exclusive). Line numbers in the output remain global. Uses a line-offset index stored alongside the input files (built on first use)", action='store',required=False)
+    parser.add_argument('--queue',type=str, help="Work queue file (SQLite) for distributed extraction with --coordinator and --worker, must reside on a filesystem shared by all workers", action='store',required=False)
+    parser.add_argument('--coordinator', help="Coordinator mode: split the source/target files (-S/-T) into shards, publish them in the work queue (--queue), wait for the workers and output the reassembled results", action='store_true',required=False)
+    parser.add_argument('--worker', help="Worker mode: process shards from the work queue (--queue) until all are done; extraction parameters are taken from the coordinator", action='store_true',required=False)
+    parser.add_argument('--reset', help="Discard the job already published in the work queue and publish a new one (coordinator mode). Without it, a coordinator only resumes a published job if it has the same input files, line range and parameters", action='store_true',required=False)
+    parser.add_argument('--shardsize',type=int, help="Number of lines per shard (coordinator mode)", action='store',default=10000,required=False)
+    parser.add_argument('--stale',type=int, help="Reclaim shards from workers that did not send a heartbeat for this many seconds (coordinator mode)", action='store',default=300,required=False)
+    parser.add_argument('--poll',type=int, help="Interval in seconds at which to poll the work queue", action='store',default=5,required=False)
     parser.add_argument('inputfiles', nargs='*', help='FoLiA input documents, use with -s to choose source language. For tramooc style usage: use -S/-T or --evalfile instead of this.')
     #hidden power options:
-    parser.add_argument('--foliaset',type=str, help=argparse.SUPPRESS, action='store',default="https://raw.githubusercontent.com/proycon/babelente/master/setdefinitions/babelente.babelnet.ttl", required=False)
-    parser.add_argument('--foliarelationset',type=str, help=argparse.SUPPRESS, action='store',default="https://raw.githubusercontent.com/proycon/babelente/master/setdefinitions/babelente.relations.ttl", required=False)
-    parser.add_argument('--foliametricset',type=str, help=argparse.SUPPRESS, action='store',default="https://raw.githubusercontent.com/proycon/babelente/master/setdefinitions/babelente.metrics.ttl", required=False)
+    parser.add_argument('--foliaset',type=str, help=argparse.SUPPRESS, action='store',default=FOLIASET, required=False)
+    parser.add_argument('--foliarelationset',type=str, help=argparse.SUPPRESS, action='store',default=FOLIARELATIONSET, required=False)
+    parser.add_argument('--foliametricset',type=str, help=argparse.SUPPRESS, action='store',default=FOLIAMETRICSET, required=False)
     args = parser.parse_args()
 
-    if not args.source and not args.target and not args.evalfile and not args.inputfiles:
+    if not args.source and not args.target and not args.evalfile and not args.inputfiles and not args.worker:
         print("ERROR: For Tramooc style usage, specify either --source/-S (with or without --target/-T, or --evalfile.", file=sys.stderr)
         print("       For entity extraction & linking on FoLiA documents, just specify one or more FoLiA documents", file=sys.stderr)
         print("        along with --sourcelang to choose source language.", file=sys.stderr)
@@ -449,41 +1320,74 @@ def main():
     if args.target and not args.source:
         print("ERROR: Specify --source/-S as well when --target/-T is used . See babelente -h for usage instructions.",file=sys.stderr)
         sys.exit(2)
-    if (args.target or args.source or args.inputfiles) and not args.apikey:
-        print("ERROR: Specify an API key (--apikey). Get one on http://babelnet.org/",file=sys.stderr)
+    if args.locallinker and not args.cache:
+        print("ERROR: The local linker (--locallinker) is built from the cache, specify --cache as well.",file=sys.stderr)
+        sys.exit(2)
+    if (args.coordinator or args.worker) and not args.queue:
+        print("ERROR: Specify a work queue file (--queue) for --coordinator/--worker.",file=sys.stderr)
+        sys.exit(2)
+    if args.coordinator and not args.source:
+        print("ERROR: Specify --source/-S (and optionally --target/-T) for --coordinator.",file=sys.stderr)
+        sys.exit(2)
+    keypool = KeyPool(args.ratelimit)
+    if args.apikey:
+        keypool.add(args.apikey)
+    for key in loadkeys(args.apikeyfile):
+        keypool.add(key)
+
+    if (args.target or args.source or args.inputfiles or args.worker) and not keypool.keys and not args.dryrun and not (args.coordinator and not args.recall):
+        print("ERROR: Specify an API key (--apikey, --apikeyfile or the environment variable BABELNET_API_KEYS). Get one on http://babelnet.org/",file=sys.stderr)
         sys.exit(2)
     if args.target and not args.targetlang:
         print("ERROR: Specify a target language (-t).",file=sys.stderr)
         sys.exit(2)
+    if args.recallsamplerate is not None and not (0 < args.recallsamplerate <= 1):
+        print("ERROR: --recall-sample-rate must be in the range (0,1]",file=sys.stderr)
+        sys.exit(2)
+    if args.recallsample is not None and args.recallsample < 1:
+        print("ERROR: --recall-sample must be at least 1",file=sys.stderr)
+        sys.exit(2)
+    if args.recallsample or args.recallsamplerate:
+        args.recall = True
+
+    budget = Budget(args.deadline, args.maxrequests)
+
+    progress = Progress()
+    if args.progress:
+        progress.callbacks.append(ProgressFile(args.progress))
+        progress.interval = args.progressinterval
+
+    if args.worker:
+        cache = loadcache(args.cache)
+        runworker(args, cache, keypool, budget, progress)
+        savecache(args.cache, cache, args.sharedcache)
+        reportkeys(keypool)
+        return True
 
     if args.inputfiles:
         if not args.sourcelang:
             print("ERROR: Specify a source language (-s)",file=sys.stderr)
             sys.exit(2)
+        from folia import main as folia
         first = True
         textdoc = False
+        engine = BabelEnte.fromargs(args, None, keypool, budget, progress)
         for filename in args.inputfiles:
             if not os.path.exists(filename):
                 print("ERROR: No such file: " + filename)
                 sys.exit(2)
-            if filename[-3:].lower() == ".xml":
+            if filename[-4:].lower() == ".xml":
                 #FoLiA based, extraction only
                 print("Loading FoLiA document " + filename + " ...",file=sys.stderr)
                 doc = folia.Document(file=filename)
                 if first:
                     print("[")
                     first = False
-                processfolia(doc, args, None)
+                for entity in engine.annotate_folia(doc):
+                    print(entity, ",")
 
                 if args.outputdir != '/dev/null':
-                    outputname = os.path.basename(filename)
-                    if outputname.endswith('.folia.xml'):
-                        outputname = outputname.replace('.folia.xml','.babelente.folia.xml')
-                    elif outputname.endswith('.xml'):
-                        outputname = outputname.replace('.xml','.babelente.folia.xml')
-                    else:
-                        outputname = outputname + '.babelente.folia.xml'
-                    doc.save(os.path.join(args.outputdir,outputname))
+                    doc.save(os.path.join(args.outputdir,foliaoutputname(filename)))
             else:
                 #text-based
                 textdoc = True
@@ -497,63 +1401,121 @@ def main():
             return True
 
     #Tramooc-style extraction, translation and evaluation
-    with open(args.source, 'r',encoding='utf-8') as f:
-        sourcelines = [ stripmultispace(l) for l in f.readlines() ]
+    if args.lines:
+        sourceindex = loadlineindex(args.source)
+        try:
+            firstlinenr, lastlinenr = parselinerange(args.lines, linecount(sourceindex))
+        except ValueError as e:
+            print("ERROR: " + str(e),file=sys.stderr)
+            sys.exit(2)
+        print("Processing lines " + str(firstlinenr) + " to " + str(lastlinenr) + " (exclusive)",file=sys.stderr)
+        sourcelines = readlinerange(args.source, firstlinenr, lastlinenr - 1, sourceindex)
+        if args.target:
+            targetindex = loadlineindex(args.target)
+            if linecount(sourceindex) != linecount(targetindex):
+                print("ERROR: Expected the same number of line in source and target files, but got " + str(linecount(sourceindex)) + " vs " + str(linecount(targetindex)) ,file=sys.stderr)
+                sys.exit(2)
+            targetlines = readlinerange(args.target, firstlinenr, lastlinenr - 1, targetindex)
+    else:
+        firstlinenr = 0
+        with open(args.source, 'r',encoding='utf-8', newline='\n') as f: #split on \n only, as the line-offset index does
+            sourcelines = [ stripmultispace(l) for l in f ]
 
-    if args.target:
-        with open(args.target, 'r',encoding='utf-8') as f:
-            targetlines = [ stripmultispace(l) for l in f.readlines() ]
+        if args.target:
+            with open(args.target, 'r',encoding='utf-8', newline='\n') as f:
+                targetlines = [ stripmultispace(l) for l in f ]
 
-        if len(sourcelines) != len(targetlines):
-            print("ERROR: Expected the same number of line in source and target files, but got " + str(len(sourcelines)) + " vs " + str(len(targetlines)) ,file=sys.stderr)
-            sys.exit(2)
+            if len(sourcelines) != len(targetlines):
+                print("ERROR: Expected the same number of line in source and target files, but got " + str(len(sourcelines)) + " vs " + str(len(targetlines)) ,file=sys.stderr)
+                sys.exit(2)
 
-    if args.cache:
-        if os.path.exists(args.cache):
-            print("Loading cache from " + args.cache,file=sys.stderr)
-            with open(args.cache, 'rb') as f:
-                cache = pickle.load(f)
+    cache = loadcache(args.cache)
+    engine = BabelEnte.fromargs(args, cache, keypool, budget, progress)
+
+    if args.dryrun:
+        sourceentities = None
+        if args.evalfile:
+            with open(args.evalfile,'rb') as f:
+                sourceentities = json.load(f)['sourceentities']
+            if args.lines:
+                sourceentities = [ entity for entity in sourceentities if firstlinenr <= entity['linenr'] < lastlinenr ]
+        plan = planrun(sourcelines, targetlines if args.target else None, args, cache, sourceentities, keypool)
+        print(json.dumps({'plan': plan}, indent=4,ensure_ascii=False))
+        print("BABELFYREQUESTS=" + str(plan['requests']), "CACHEHITS=" + str(plan['cachehits']), "REQUESTBYTES=" + str(plan['requestbytes']), "RESPONSEBYTES(est)=" + str(plan['estimatedresponsebytes']), file=sys.stderr)
+        if plan['getsynset'] is None:
+            print("GETSYNSETCALLS=unknown CACHEHITS=unknown", file=sys.stderr)
         else:
-            print("Creating new cache " + args.cache,file=sys.stderr)
-            cache = {'source':{}, 'target': {}, 'synsets_source': {}, 'synsets_target': {}}
-    else:
-        cache = None
+            print("GETSYNSETCALLS" + ("(est)" if plan['estimated'] else "") + "=" + str(plan['getsynset']), "CACHEHITS=" + str(plan['getsynsetcachehits']), file=sys.stderr)
+        print("DURATION(est)=" + str(round(plan['estimatedduration'])) + "s" + ("" if plan['durationincludesrecall'] else " (excluding recall)"), file=sys.stderr)
+        return True
 
     evaluation = None
+    linkerstats = {}
+    skipped = {'source': set(), 'target': set()} #lines not processed within the budget
     if args.evalfile:
         with open(args.evalfile,'rb') as f:
             data = json.load(f)
         sourceentities = data['sourceentities']
         targetentities = data['targetentities']
+        if args.lines:
+            sourceentities = [ entity for entity in sourceentities if firstlinenr <= entity['linenr'] < lastlinenr ]
+            targetentities = [ entity for entity in targetentities if firstlinenr <= entity['linenr'] < lastlinenr ]
 
         print("Evaluating...",file=sys.stderr)
-        evaluation = evaluate(sourceentities, targetentities, sourcelines, targetlines, args.recall, args.targetlang, args.apikey, args.nodup, None if cache is None else cache['synsets_source'], args.debug)
+        if args.recall:
+            progress.expect(1)
+        evaluation = engine.evaluate(sourceentities, targetentities, sourcelines, targetlines, args.targetlang, args.recall, args.nodup, args.recallsample, args.recallsamplerate, args.recallstratify, args.seed, firstlinenr)
     else:
-        print("Extracting source entities...",file=sys.stderr)
-        sourceentities = [ entity for  entity in findentities(sourcelines, args.sourcelang, args, None if cache is None else cache['source']) if entity['isEntity'] and 'babelSynsetID' in entity ] #with sanity check
+        progress.expect(1 + bool(args.target and args.recall))
+        if args.coordinator:
+            print("Distributing extraction over workers...",file=sys.stderr)
+            sourceentities, targetentities = runcoordinator(args, len(sourcelines), len(targetlines) if args.target else 0, firstlinenr, skipped, budget, progress)
+        elif args.target:
+            #source and target are extracted alternately, so a run cut short by the budget still has lines to evaluate
+            print("Extracting source and target entities...",file=sys.stderr)
+            sourceentities, targetentities = engine.extract_parallel(sourcelines, targetlines, args.sourcelang, args.targetlang, firstlinenr, skipped)
+        else:
+            print("Extracting source entities...",file=sys.stderr)
+            sourceentities = list(engine.extract(sourcelines, args.sourcelang, 'source', firstlinenr, skipped['source']))
+        if not args.coordinator:
+            linkerstats = reportlinkers(engine.linkers)
 
         if args.target:
-            print("Extracting target entities...",file=sys.stderr)
-            targetentities = [ entity for  entity in findentities(targetlines, args.targetlang, args, None if cache is None else cache['target']) if entity['isEntity'] and 'babelSynsetID' in entity ] #with sanity check
-
             print("Evaluating...",file=sys.stderr)
-            evaluation = evaluate(sourceentities, targetentities, sourcelines, targetlines, args.recall, args.targetlang, args.apikey, args.nodup, None if cache is None else cache['synsets_target'], args.debug)
+            evaluation = engine.evaluate(sourceentities, targetentities, sourcelines, targetlines, args.targetlang, args.recall, args.nodup, args.recallsample, args.recallsamplerate, args.recallstratify, args.seed, firstlinenr, skipped['source'] | skipped['target'])
         else:
-            print(json.dumps({'entities':sourceentities}, indent=4,ensure_ascii=False)) #MAYBE TODO: add coverage?
+            output = {'entities':sourceentities}
+            if linkerstats:
+                output['locallinker'] = linkerstats
+            if budget.limited() or budget.exhausted() or skipped['source']:
+                output['coverage'] = reportcoverage(budget, skipped, firstlinenr, len(sourcelines), ('source',))
+            print(json.dumps(output, indent=4,ensure_ascii=False))
 
     if evaluation is not None:
-        print(json.dumps({'sourceentities':sourceentities, 'targetentities': targetentities, 'evaluation': evaluation}, indent=4,ensure_ascii=False))
+        if args.lines:
+            evaluation['lines'] = [firstlinenr, lastlinenr]
+        output = {'sourceentities':sourceentities, 'targetentities': targetentities, 'evaluation': evaluation}
+        if linkerstats:
+            output['locallinker'] = linkerstats
+        if budget.limited() or budget.exhausted() or skipped['source'] or skipped['target']:
+            output['coverage'] = reportcoverage(budget, skipped, firstlinenr, len(sourcelines), ('source','target') if not args.evalfile else ())
+        print(json.dumps(output, indent=4,ensure_ascii=False))
         #output summary to stderr (info is all in JSON stdout output as well)
         print("PRECISION(macro)=" + str(round(evaluation['precision'],3)), "RECALL(macro)=" + str(round(evaluation['recall'],3)), file=sys.stderr)
         print("PRECISION(micro)=" + str(round(evaluation['microprecision'], 3)), "RECALL(micro)=" + str(round(evaluation['microrecall'],3)), file=sys.stderr)
+        if 'recallestimate' in evaluation:
+            estimate = evaluation['recallestimate']
+            print("RECALL(macro," + str(round(estimate['confidence']*100)) + "%CI)=" + str([ round(x,3) for x in estimate['recall_ci'] ]), "RECALL(micro," + str(round(estimate['confidence']*100)) + "%CI)=" + str([ round(x,3) for x in estimate['microrecall_ci'] ]), "SAMPLEDSYNSETS=" + str(estimate['sampledsynsets']) + "/" + str(estimate['totalsynsets']), file=sys.stderr)
         print("SOURCECOVERAGE=" + str(round(evaluation['sourcecoverage'],3)), "TARGETCOVERAGE=" + str(round(evaluation['targetcoverage'],3)), file=sys.stderr)
         print("SOURCEENTITIES=" + str(len(sourceentities)), "TARGETENTITIES=" + str(len(targetentities)))
         print("MATCHES=" + str(evaluation['matches']), file=sys.stderr)
         print("TRANSLATABLEENTITIES=" + str(evaluation['translatableentities']), file=sys.stderr)
+        if 'coverage' in evaluation:
+            print("EVALUATEDLINES=" + str(evaluation['coverage']['evaluatedlines']) + "/" + str(evaluation['coverage']['lines']) + ("" if 'recalllines' not in evaluation['coverage'] else " RECALLLINES=" + str(evaluation['coverage']['recalllines'])), file=sys.stderr)
 
-    if cache is not None:
-        with open(args.cache,'wb') as f:
-            pickle.dump(cache,f)
+    savecache(args.cache, cache, args.sharedcache)
+    reportkeys(keypool)
+    progress.finish()
 
 
 if __name__ == '__main__':
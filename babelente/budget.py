@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Budget for deadline- and request-bounded runs.
+
+Every query to BabelFy/BabelNet is charged to the budget before it is made. Once the deadline has passed or the maximum
+number of requests has been made, the budget is exhausted for the remainder of the run and no new queries are allowed;
+queries already underway are finished and results from the cache can still be used. A run can also be stopped
+explicitly, for instance when no usable API keys remain."""
+
+import time
+
+class BudgetExhausted(Exception):
+    """Raised when a query is not allowed because the budget is exhausted"""
+    pass
+
+class Budget:
+    def __init__(self, deadline=None, maxrequests=None):
+        self.deadline = deadline #seconds from the start
+        self.maxrequests = maxrequests
+        self.requests = 0
+        self.starttime = time.time()
+        self.reason = None #reason the budget is exhausted
+
+    def limited(self):
+        return self.deadline is not None or self.maxrequests is not None
+
+    def exhausted(self):
+        """Returns the reason the budget is exhausted ('deadline', 'maxrequests' or the reason passed to stop()), or None if it is not"""
+        if self.reason is None:
+            if self.deadline is not None and time.time() - self.starttime >= self.deadline:
+                self.reason = 'deadline'
+            elif self.maxrequests is not None and self.requests >= self.maxrequests:
+                self.reason = 'maxrequests'
+        return self.reason
+
+    def stop(self, reason):
+        """Exhaust the budget for the remainder of the run, e.g. 'quota' when no usable API keys remain"""
+        if self.reason is None:
+            self.reason = reason
+
+    def charge(self):
+        """Charge a query that is about to be made, raises BudgetExhausted if the budget does not allow it"""
+        reason = self.exhausted()
+        if reason is not None:
+            raise BudgetExhausted(reason)
+        self.requests += 1
+
+    def report(self):
+        return {
+            'deadline': self.deadline,
+            'maxrequests': self.maxrequests,
+            'requests': self.requests,
+            'elapsed': time.time() - self.starttime,
+            'stopped': self.exhausted(),
+        }
+
+def lineranges(linenrs):
+    """Collapse line numbers into a list of [start, end] ranges (end exclusive)"""
+    ranges = []
+    for linenr in sorted(linenrs):
+        if ranges and ranges[-1][1] == linenr:
+            ranges[-1][1] = linenr + 1
+        else:
+            ranges.append([linenr, linenr + 1])
+    return ranges
+
+def complementranges(linenrs, start, end):
+    """Returns the [start, end] ranges (end exclusive) of the lines from start to end that are not in linenrs"""
+    ranges = []
+    for first, last in lineranges(linenrs) + [[end, end]]:
+        first = min(first, end)
+        if first > start:
+            ranges.append([start, first])
+        start = max(start, last)
+    return ranges
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Pool of BabelNet API keys.
+
+Queries are distributed over all keys in the pool, each key has its own rate limit. Keys that are rejected (typically
+because their daily quota has been reached) are taken out of the pool for the remainder of the run, and usage is tracked
+per key."""
+
+import os
+import time
+
+ENVIRONMENTVARIABLE = "BABELNET_API_KEYS"
+
+class QuotaExceeded(Exception):
+    """Raised when a key is rejected by BabelFy/BabelNet, or when no usable keys remain"""
+    pass
+
+class RateLimiter:
+    """Limits the number of queries per second"""
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.last = 0.0
+
+    def next(self):
+        """Returns the time at which the next query may be made"""
+        if self.rate:
+            return self.last + 1.0 / self.rate
+        return self.last
+
+    def wait(self):
+        if self.rate:
+            delay = self.next() - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self.last = time.time()
+
+class KeyPool:
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.keys = [] #in order of addition
+        self.ratelimiters = {}
+        self.usage = {} #key => Counter-like dictionary
+        self.rejected = {} #key => reason
+
+    def add(self, key):
+        key = key.strip()
+        if key and key not in self.ratelimiters:
+            self.keys.append(key)
+            self.ratelimiters[key] = RateLimiter(self.rate)
+            self.usage[key] = {'babelfy': 0, 'getsynset': 0}
+
+    def setrate(self, rate):
+        """Set the maximum number of queries per second, per key"""
+        self.rate = rate
+        for ratelimiter in self.ratelimiters.values():
+            ratelimiter.rate = rate
+
+    def available(self):
+        return [ key for key in self.keys if key not in self.rejected ]
+
+    def exhausted(self, fallback=None):
+        """Returns True if no usable keys remain, i.e. acquire() would raise QuotaExceeded"""
+        return not self.available() and not (not self.keys and fallback)
+
+    def acquire(self, fallback=None):
+        """Acquire a key for a query, waiting for the rate limit if needed. The key that is available soonest is chosen.
+        If the pool is empty, the fallback key is added first. Raises QuotaExceeded if no usable keys remain"""
+        if not self.keys and fallback:
+            self.add(fallback)
+        keys = self.available()
+        if not keys:
+            raise QuotaExceeded("No usable API keys left" + (" (" + "; ".join( redact(key) + ": " + reason for key, reason in self.rejected.items()) + ")" if self.rejected else ""))
+        key = min(keys, key=lambda key: self.ratelimiters[key].next())
+        self.ratelimiters[key].wait()
+        return key
+
+    def used(self, key, service):
+        """Register a successful query with the key"""
+        self.usage[key][service] += 1
+
+    def reject(self, key, reason=""):
+        """Take a key out of the pool, for instance because its quota has been reached"""
+        self.rejected[key] = reason
+
+    def report(self):
+        """Returns the usage per key (keys are redacted)"""
+        return { redact(key): dict(self.usage[key], rejected=self.rejected.get(key)) for key in self.keys }
+
+def redact(key):
+    """Redact a key for reporting, keeping just enough to tell keys apart"""
+    return key[:4] + "..." + key[-4:] if len(key) > 12 else "..." + key[-2:]
+
+def loadkeys(filename=None):
+    """Load API keys from a file (one per line, # for comments) and/or the BABELNET_API_KEYS environment variable (comma or whitespace separated)"""
+    keys = []
+    if filename:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and line[0] != '#':
+                    keys.append(line)
+    if os.environ.get(ENVIRONMENTVARIABLE):
+        keys += os.environ[ENVIRONMENTVARIABLE].replace(",", " ").split()
+    return keys
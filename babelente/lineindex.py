@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Persistent line-offset index for (large) plain text input files.
+
+The index holds the byte offset at which each line starts, followed by the size of the file, so line i spans the bytes
+index[i] to index[i+1]. It is stored alongside the input file as a numpy array and memory-mapped when loaded, so
+arbitrary line ranges can be read without reading the whole file. If the index can not be stored there (e.g. a read-only
+directory), it is kept in memory only and rebuilt on each run."""
+
+import os
+import sys
+
+INDEXEXTENSION = ".lineindex.npy"
+
+def indexfilename(filename):
+    return filename + INDEXEXTENSION
+
+def buildlineindex(filename, blocksize=64*1024*1024):
+    """Build the line-offset index for a file and save it alongside the file, if possible. Returns the index"""
+    import numpy as np
+    offsets = [ np.zeros(1, dtype=np.uint64) ]
+    position = 0
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n"))
+            offsets.append( (newlines + position + 1).astype(np.uint64) )
+            position += len(block)
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != position:
+        #last line has no trailing newline
+        offsets = np.append(offsets, np.uint64(position))
+    #write to a temporary file first so concurrent readers never see a partial index
+    tmpfilename = indexfilename(filename) + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(tmpfilename, 'wb') as f:
+            np.save(f, offsets)
+        os.replace(tmpfilename, indexfilename(filename))
+    except OSError as e:
+        print("WARNING: Unable to save the line index for " + filename + " (" + str(e) + "), keeping it in memory only",file=sys.stderr)
+        if os.path.exists(tmpfilename):
+            os.unlink(tmpfilename)
+    return offsets
+
+def loadlineindex(filename, build=True):
+    """Load the line-offset index for a file (memory-mapped), (re)building it if it does not exist or is out of date. Returns None if there is no valid index and build is False"""
+    import numpy as np
+    indexfile = indexfilename(filename)
+    if os.path.exists(indexfile) and os.path.getmtime(indexfile) >= os.path.getmtime(filename):
+        offsets = np.load(indexfile, mmap_mode='r')
+        if len(offsets) and int(offsets[-1]) == os.path.getsize(filename):
+            return offsets
+    if build:
+        return buildlineindex(filename)
+    return None
+
+def linecount(offsets):
+    """Returns the number of lines in an indexed file"""
+    return len(offsets) - 1
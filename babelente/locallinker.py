@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Local lexicon-based entity linker, built from cached BabelFy results.
+
+The linker collects all surface forms BabelFy linked in the cached chunks into a token trie, and counts how often each
+surface form occurs in the cached texts at all and how often it was linked to each synset. A surface form is linked
+locally with confidence (linked to its most frequent synset / occurrences) if it has been seen often enough. A line is only
+resolved locally if all surface forms found in it are linked with high confidence and each of its other words has been
+seen often enough outside of any surface form in the cached texts (so it is safe to leave it unlinked), otherwise it is
+left for BabelFy."""
+
+import re
+from collections import Counter, defaultdict
+
+TOKENIZER = re.compile(r"\w+|[^\w\s]")
+
+#entity fields that are copied from the cached BabelFy results
+LINKFIELDS = ('babelSynsetID', 'DBpediaURL', 'BabelNetURL')
+
+class LocalLinker:
+    def __init__(self, threshold=0.95, minsupport=5):
+        self.threshold = threshold
+        self.minsupport = minsupport
+        self.trie = {} #token => (children, surface form or None)
+        self.vocabulary = Counter() #word => number of occurrences outside of known surface forms in the cached texts
+        self.occurrences = Counter() #surface form => number of occurrences in the cached texts
+        self.links = defaultdict(Counter) #surface form => synset => number of times linked
+        self.scores = defaultdict(lambda: [0.0, 0.0, 0.0, 0]) #(surface form, synset) => summed score, coherenceScore, globalScore, count
+        self.fields = {} #synset => fields to copy
+        #statistics
+        self.resolvedlines = self.deferredlines = 0
+        self.avoidedrequests = self.avoidedbytes = 0
+
+    @staticmethod
+    def fromcache(cache, threshold=0.95, minsupport=5):
+        """Build a linker from a cache of BabelFy results (chunk text => entities)"""
+        linker = LocalLinker(threshold, minsupport)
+        for text, entities in cache.items():
+            for entity in entities:
+                if entity.get('isEntity') and 'babelSynsetID' in entity:
+                    linker.addlink(entity)
+        for text in cache:
+            linker.addtext(text)
+        return linker
+
+    def addlink(self, entity):
+        surface = entity['text']
+        tokens = TOKENIZER.findall(surface)
+        if not tokens:
+            return
+        node = self.trie
+        for i, token in enumerate(tokens):
+            if token not in node:
+                node[token] = ({}, None)
+            if i == len(tokens) - 1:
+                node[token] = (node[token][0], surface)
+            node = node[token][0]
+        synset_id = entity['babelSynsetID']
+        self.links[surface][synset_id] += 1
+        scores = self.scores[(surface, synset_id)]
+        scores[0] += float(entity.get('score', 0.0))
+        scores[1] += float(entity.get('coherenceScore', 0.0))
+        scores[2] += float(entity.get('globalScore', 0.0))
+        scores[3] += 1
+        if synset_id not in self.fields:
+            self.fields[synset_id] = { key: entity[key] for key in LINKFIELDS if key in entity }
+
+    def addtext(self, text):
+        """Count the occurrences of all known surface forms in a cached text, and add its other words to the vocabulary"""
+        tokens = [ (m.group(0), m.start(), m.end()) for m in TOKENIZER.finditer(text) ]
+        covered = set()
+        for surface, _, _, first, last in self.matches(text, tokens):
+            self.occurrences[surface] += 1
+            covered.update(range(first, last+1))
+        self.vocabulary.update( token for i, (token, _, _) in enumerate(tokens) if i not in covered )
+
+    def matches(self, text, tokens):
+        """Find all known surface forms in the text (at token boundaries), yields (surface, start, end, firsttoken, lasttoken) tuples, end exclusive"""
+        for i in range(len(tokens)):
+            node = self.trie
+            for j in range(i, len(tokens)):
+                token, _, end = tokens[j]
+                if token not in node:
+                    break
+                children, surface = node[token]
+                start = tokens[i][1]
+                if surface is not None and text[start:end] == surface:
+                    yield surface, start, end, i, j
+                node = children
+
+    def confidence(self, surface):
+        """Returns the best synset for the surface form and the confidence in linking it"""
+        if self.occurrences[surface] < self.minsupport or surface not in self.links:
+            return None, 0.0
+        synset_id, count = self.links[surface].most_common(1)[0]
+        return synset_id, min(1.0, count / self.occurrences[surface])
+
+    def link(self, line):
+        """Link the entities in a line locally. Returns a list of entities in the same format as BabelFy's, or None if the line can not be resolved with confidence"""
+        tokens = [ (m.group(0), m.start(), m.end()) for m in TOKENIZER.finditer(line) ]
+        matches = list(self.matches(line, tokens))
+        covered = set()
+        for _, _, _, first, last in matches:
+            covered.update(range(first, last+1))
+        for i, (token, _, _) in enumerate(tokens):
+            if i not in covered and self.vocabulary[token] < self.minsupport:
+                #not seen often enough without a link to be sure BabelFy would not link it
+                return None
+        entities = []
+        for surface, start, end, _, _ in matches:
+            synset_id, confidence = self.confidence(surface)
+            if synset_id is None or confidence < self.threshold:
+                return None
+            score, coherencescore, globalscore, count = self.scores[(surface, synset_id)]
+            entity = dict(self.fields[synset_id])
+            entity['start'] = start
+            entity['end'] = end - 1 #inclusive, like BabelFy
+            entity['text'] = line[start:end]
+            entity['isEntity'] = True
+            entity['charFragment'] = {'start': start, 'end': end - 1}
+            #token offsets in terms of space-separated tokens, as the lines are
+            entity['tokenFragment'] = {'start': line[:start].count(" "), 'end': line[:end-1].count(" ")}
+            entity['score'] = score / count
+            entity['coherenceScore'] = coherencescore / count
+            entity['globalScore'] = globalscore / count
+            entity['source'] = 'LOCAL'
+            entity['localConfidence'] = confidence
+            entities.append(entity)
+        return entities
+
+    def stats(self):
+        return {
+            'surfaceforms': len(self.links),
+            'resolvedlines': self.resolvedlines,
+            'deferredlines': self.deferredlines,
+            'avoidedrequests': self.avoidedrequests,
+            'avoidedbytes': self.avoidedbytes,
+        }
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Progress reporting for extraction and recall computation.
+
+A run consists of one or more phases (source extraction, target extraction, recall). During each phase the number of
+processed units (lines or synsets), the queries made and the cache hits are tracked, and the status (including
+throughput and ETA) is passed to all registered callbacks, at most once per interval."""
+
+import os
+import json
+import time
+
+class Progress:
+    """Tracks the progress of a run and reports it to the registered callbacks"""
+
+    def __init__(self, interval=2.0):
+        self.callbacks = []
+        self.interval = interval
+        self.phases = 1
+        self.phasenr = 0
+        self.phase = None
+        self.total = self.done = 0
+        self.inflight = self.queries = self.cachehits = 0
+        self.starttime = time.time()
+        self.lastreport = 0.0
+
+    def expect(self, phases):
+        """Set the number of phases the run will consist of"""
+        self.phases = phases
+        self.phasenr = 0
+
+    def begin(self, phase, total):
+        """Begin a new phase of the specified number of units"""
+        self.phase = phase
+        self.total = total
+        self.done = 0
+        self.inflight = self.queries = self.cachehits = 0
+        self.starttime = time.time()
+        self.report(True)
+
+    def end(self):
+        self.done = self.total
+        self.report(True)
+        self.phasenr += 1
+
+    def finish(self):
+        """Signal the run has finished"""
+        self.phase = "done"
+        self.phasenr = self.phases
+        self.report(True)
+
+    def querystart(self):
+        self.inflight += 1
+        self.report()
+
+    def querydone(self):
+        self.inflight -= 1
+        self.queries += 1
+        self.report()
+
+    def cachehit(self):
+        self.cachehits += 1
+        self.report()
+
+    def advance(self, n=1):
+        self.done += n
+        self.report()
+
+    def status(self):
+        """Returns the current status as a dictionary"""
+        elapsed = time.time() - self.starttime
+        lookups = self.queries + self.cachehits
+        fraction = self.done / self.total if self.total else 0.0
+        return {
+            'phase': self.phase,
+            'phasenr': min(self.phasenr + 1, self.phases),
+            'phases': self.phases,
+            'done': self.done,
+            'total': self.total,
+            'inflight': self.inflight,
+            'queries': self.queries,
+            'cachehits': self.cachehits,
+            'requestspersecond': self.queries / elapsed if elapsed > 0 else 0.0,
+            'cachehitrate': self.cachehits / lookups if lookups else None,
+            'elapsed': elapsed,
+            'eta': elapsed / self.done * (self.total - self.done) if self.done else None,
+            'completion': min(100.0, 100.0 * (self.phasenr + fraction) / self.phases),
+        }
+
+    def report(self, force=False):
+        if self.callbacks and (force or time.time() - self.lastreport >= self.interval):
+            self.lastreport = time.time()
+            status = self.status()
+            for callback in self.callbacks:
+                callback(status)
+
+class ProgressFile:
+    """Progress callback that writes the status as JSON to a file, the file is replaced atomically so readers never see a partial status"""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, status):
+        tmpfilename = self.filename + ".tmp"
+        with open(tmpfilename, 'w', encoding='utf-8') as f:
+            json.dump(status, f)
+        os.replace(tmpfilename, self.filename)
+
+def formatstatus(status):
+    """Format a status as a short human readable message"""
+    msg = str(status['phase']) + " (" + str(status['phasenr']) + "/" + str(status['phases']) + "): " + str(status['done']) + "/" + str(status['total'])
+    msg += ", " + str(round(status['requestspersecond'], 2)) + " queries/s"
+    if status['cachehitrate'] is not None:
+        msg += ", cache hit rate " + str(round(status['cachehitrate'] * 100)) + "%"
+    if status['inflight']:
+        msg += ", " + str(status['inflight']) + " in flight"
+    if status['eta'] is not None:
+        msg += ", ETA " + str(round(status['eta'])) + "s"
+    return msg
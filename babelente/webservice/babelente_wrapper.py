@@ -32,15 +32,19 @@ from __future__ import print_function, unicode_literals, division, absolute_impo
 #import some general python modules:
 import sys
 import os
+import json
 
 #import CLAM-specific modules. The CLAM API makes a lot of stuff easily accessible.
 import clam.common.data
 import clam.common.status
 
-#When the wrapper is started, the current working directory corresponds to the project directory, input files are in input/ , output files should go in output/ .
+#BabelEnte is used in-process, so all input files of a job are processed in a single run
+from babelente.babelente import BabelEnte, loadcache, savecache, foliaoutputname, stripmultispace, reportkeys
+from babelente.keypool import loadkeys
+from babelente.progress import formatstatus
+from folia import main as folia
 
-#make a shortcut to the shellsafe() function
-shellsafe = clam.common.data.shellsafe
+#When the wrapper is started, the current working directory corresponds to the project directory, input files are in input/ , output files should go in output/ .
 
 #this script takes three arguments from CLAM: $DATAFILE $STATUSFILE $OUTPUTDIRECTORY
 #(as configured at COMMAND= in the service configuration file, there you can
@@ -65,8 +69,11 @@ print("Starting...", file=sys.stderr)
 
 if 'BABELNET_API_KEY' in os.environ:
     BABELNET_API_KEY = os.environ['BABELNET_API_KEY']
+elif 'BABELNET_API_KEYS' in os.environ:
+    #a pool of keys, babelente picks these up from the environment itself
+    BABELNET_API_KEY = None
 else:
-    print("No BabelNet API key found in environment variable BABELNET_API_KEY!",file=sys.stderr)
+    print("No BabelNet API key found in environment variable BABELNET_API_KEY (or BABELNET_API_KEYS)!",file=sys.stderr)
     sys.exit(2)
 
 
@@ -79,63 +86,80 @@ else:
 # method for setting up your wrapper:
 evalsource = evaltarget = None
 
+#The cache is shared by all jobs if the environment variable BABELENTE_CACHE points to a (service-wide) cache file,
+#otherwise each job has its own cache in its output directory
+if os.environ.get('BABELENTE_CACHE'):
+    cachefile = os.environ['BABELENTE_CACHE']
+    sharedcache = True
+else:
+    cachefile = os.path.join(outputdir, "cache")
+    sharedcache = False
 
-options = "-k " + BABELNET_API_KEY + " --recall -o " + shellsafe(outputdir,'"') + " --cache " + shellsafe(outputdir + "/cache",'"')
-if 'overlap' in clamdata and clamdata['overlap']:
-    options += " --overlap " + str(clamdata['overlap'])
-if 'anntype' in clamdata and clamdata['anntype']:
-    options += " --anntype " + str(clamdata['anntype'])
+options = {}
+for key in ('overlap','anntype','th','cands','match','mcs','postag'):
+    if key in clamdata and clamdata[key]:
+        options[key] = clamdata[key]
 if 'annres' in clamdata and clamdata['annres'] and clamdata['annres'] != "ALL":
-    options += " --annres " + str(clamdata['annres'])
-if 'th' in clamdata and clamdata['th']:
-    options += " --th " + str(clamdata['th'])
-if 'cands' in clamdata and clamdata['cands']:
-    options += " --cands " + str(clamdata['cands'])
-if 'match' in clamdata and clamdata['match']:
-    options += " --match " + str(clamdata['match'])
-if 'mcs' in clamdata and clamdata['mcs']:
-    options += " --mcs " + str(clamdata['mcs'])
-if 'postag' in clamdata and clamdata['postag']:
-    options += " --postag " + str(clamdata['postag'])
-if 'extaida' in clamdata and clamdata['extaida']:
-    options += " --extaida"
-if 'dens' in clamdata and clamdata['dens']:
-    options += " --dens"
-if 'nodup' in clamdata and clamdata['nodup']:
-    options += " --nodup"
+    options['annres'] = clamdata['annres']
+for key in ('extaida','dens'):
+    if key in clamdata and clamdata[key]:
+        options[key] = True
+nodup = bool('nodup' in clamdata and clamdata['nodup'])
+
+engine = BabelEnte(apikey=BABELNET_API_KEY, apikeys=loadkeys(), cache=loadcache(cachefile), **options)
+
+#babelente reports its progress as it goes, we relay it to the CLAM status file
+PROGRESSINTERVAL = 5 #seconds
+engine.progress.interval = PROGRESSINTERVAL
+engine.progress.callbacks.append(lambda status: clam.common.status.write(statusfile, formatstatus(status), min(int(status['completion']), 99)))
 
+inputs = [] #lines or FoLiA documents, all are processed together
+outputs = [] #(output json, input file) tuples, input file is set for FoLiA documents only
 for inputfile in clamdata.input:
     inputtemplate = inputfile.metadata.inputtemplate
     inputfilepath = str(inputfile)
     encoding = inputfile.metadata['encoding'] #Example showing how to obtain metadata parameters
     if inputtemplate == "inputtext":
-        msg = "Processing text document " + os.path.basename(inputfilepath)
-        clam.common.status.write(statusfile, msg) # status update
-        print(msg, file=sys.stderr)
-        outputjson = os.path.join(outputdir, os.path.basename(inputfilepath[:-4]) + '.json') #remove .txt extension, add .json
-        cmd = "babelente " + options + " -s " + shellsafe(clamdata['lang'],'"') + " -S " + shellsafe(inputfilepath,'"') + " > " + shellsafe(outputjson,'"')
-        print(cmd.replace(BABELNET_API_KEY,"###REDACTED###"), file=sys.stderr)
-        os.system(cmd) == 0 or sys.exit(2)
+        print("Loading text document " + os.path.basename(inputfilepath), file=sys.stderr)
+        with open(inputfilepath, 'r', encoding='utf-8', newline='\n') as f:
+            inputs.append( [ stripmultispace(line) for line in f ] )
+        outputs.append( (os.path.join(outputdir, os.path.basename(inputfilepath[:-4]) + '.json'), None) ) #remove .txt extension, add .json
     elif inputtemplate == "inputfolia":
-        msg = "Processing FoLiA document " + os.path.basename(inputfilepath) # status update
-        clam.common.status.write(statusfile, msg) # status update
-        print(msg, file=sys.stderr)
-        outputjson = os.path.join(outputdir, os.path.basename(inputfilepath[:-10]) + '.json') #remove .folia.xml extension, add .json
-        cmd = "babelente " + options + " -s " + shellsafe(clamdata['lang'],'"') + " " + shellsafe(inputfilepath,'"') + " > " + shellsafe(outputjson,'"')
-        print(cmd.replace(BABELNET_API_KEY,"###REDACTED###"), file=sys.stderr)
-        os.system(cmd) == 0 or sys.exit(2)
+        print("Loading FoLiA document " + os.path.basename(inputfilepath), file=sys.stderr)
+        inputs.append( folia.Document(file=inputfilepath) )
+        outputs.append( (os.path.join(outputdir, os.path.basename(inputfilepath[:-10]) + '.json'), inputfilepath) ) #remove .folia.xml extension, add .json
     elif inputtemplate == "evalsource":
         evalsource = inputfilepath
     elif inputtemplate == "evaltarget":
         evaltarget = inputfilepath
 
+engine.progress.expect(bool(inputs) + (2 if evalsource and evaltarget else 0))
+
+if inputs:
+    clam.common.status.write(statusfile, "Processing " + str(len(inputs)) + " document(s)", 0) # status update
+    for (outputjson, foliafile), entities, inputdata in zip(outputs, engine.extract_batch(inputs, clamdata['lang']), inputs):
+        with open(outputjson,'w',encoding='utf-8') as f:
+            json.dump({'entities': entities}, f, indent=4, ensure_ascii=False)
+        if foliafile:
+            inputdata.save(os.path.join(outputdir, foliaoutputname(foliafile)))
+
 if evalsource and evaltarget:
     #Implicit Evaluation pipeline (TraMOOC)
     clam.common.status.write(statusfile, "Conducting Implicit Translation Evaluation...") # status update
-    outputjson = os.path.join(outputdir, 'evaluation.json') #remove .folia.xml extension, add .json
-    os.system("babelente " + options + " -s en -t " + shellsafe(clamdata['lang'],'"') + " -S " + shellsafe(evalsource,'"') + " -T " + shellsafe(evaltarget,'"') + " > " + shellsafe(outputjson,'"')) == 0 or sys.exit(2)
-
-
+    with open(evalsource, 'r', encoding='utf-8', newline='\n') as f:
+        sourcelines = [ stripmultispace(line) for line in f ]
+    with open(evaltarget, 'r', encoding='utf-8', newline='\n') as f:
+        targetlines = [ stripmultispace(line) for line in f ]
+    if len(sourcelines) != len(targetlines):
+        print("Expected the same number of lines in source and target files, but got " + str(len(sourcelines)) + " vs " + str(len(targetlines)), file=sys.stderr)
+        sys.exit(2)
+    sourceentities, targetentities = engine.extract_parallel(sourcelines, targetlines, "en", clamdata['lang'])
+    evaluation = engine.evaluate(sourceentities, targetentities, sourcelines, targetlines, clamdata['lang'], recall=True, nodup=nodup)
+    with open(os.path.join(outputdir, 'evaluation.json'),'w',encoding='utf-8') as f:
+        json.dump({'sourceentities':sourceentities, 'targetentities': targetentities, 'evaluation': evaluation}, f, indent=4, ensure_ascii=False)
+
+savecache(cachefile, engine.cache, sharedcache)
+reportkeys(engine.keypool)
 
 clam.common.status.write(statusfile, "Done",100) # status update
 print("Done",file=sys.stderr)
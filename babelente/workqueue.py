@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Local work queue (SQLite-backed) for distributed entity extraction.
+
+A coordinator splits the source and target files into line-range shards and publishes them in a queue database,
+workers (on the same machine or on other machines sharing the filesystem) claim shards, run the extraction and store the
+results back in the queue. Workers keep a heartbeat, shards claimed by workers whose heartbeat went stale are reclaimed.
+No external services are needed."""
+
+import os
+import json
+import socket
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+class WorkQueue:
+    def __init__(self, filename, timeout=60):
+        self.filename = filename
+        self.timeout = timeout
+        self.db = self.connect()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS shards (
+                id INTEGER PRIMARY KEY,
+                side TEXT NOT NULL,
+                firstline INTEGER NOT NULL,
+                lastline INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                heartbeat REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT
+            );
+        """)
+
+    def connect(self):
+        db = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        return db
+
+    def close(self):
+        self.db.close()
+
+    def published(self):
+        """Has a job already been published in this queue?"""
+        return self.db.execute("SELECT COUNT(*) FROM shards").fetchone()[0] > 0
+
+    def publish(self, params, shards):
+        """Publish a job: params is a JSON-serialisable dictionary of job parameters, shards is a list of (side, firstline, lastline) tuples (lastline inclusive)"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("DELETE FROM job")
+            self.db.execute("DELETE FROM shards")
+            self.db.execute("INSERT INTO job (key, value) VALUES ('params', ?)", (json.dumps(params),))
+            self.db.executemany("INSERT INTO shards (side, firstline, lastline) VALUES (?, ?, ?)", shards)
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def params(self):
+        """Returns the job parameters, or None if no job was published yet"""
+        row = self.db.execute("SELECT value FROM job WHERE key = 'params'").fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def claim(self, worker):
+        """Claim the next pending shard for the specified worker. Returns a (shard id, side, firstline, lastline) tuple or None if there is nothing left to claim"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT id, side, firstline, lastline FROM shards WHERE status = ? ORDER BY id LIMIT 1", (PENDING,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE shards SET status = ?, worker = ?, heartbeat = ?, attempts = attempts + 1 WHERE id = ?", (CLAIMED, worker, time.time(), row[0]))
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+        return row
+
+    def heartbeat(self, shard_id, worker, db=None):
+        """Signal that the worker is still alive and processing the shard"""
+        (db or self.db).execute("UPDATE shards SET heartbeat = ? WHERE id = ? AND worker = ? AND status = ?", (time.time(), shard_id, worker, CLAIMED))
+
+    def complete(self, shard_id, worker, result):
+        """Store the result for a shard. Returns False if the shard was meanwhile reclaimed and given to another worker, in which case the result is discarded"""
+        cursor = self.db.execute("UPDATE shards SET status = ?, result = ?, heartbeat = ? WHERE id = ? AND worker = ? AND status = ?", (DONE, json.dumps(result, ensure_ascii=False), time.time(), shard_id, worker, CLAIMED))
+        return cursor.rowcount > 0
+
+    def reclaim(self, stale):
+        """Return shards of workers that have not sent a heartbeat for the specified number of seconds to the pending pool. Returns the number of reclaimed shards"""
+        cursor = self.db.execute("UPDATE shards SET status = ?, worker = NULL WHERE status = ? AND heartbeat < ?", (PENDING, CLAIMED, time.time() - stale))
+        return cursor.rowcount
+
+    def cancel(self):
+        """Cancel all pending shards (so no worker will claim them), shards that are already claimed are left to finish. Returns the number of cancelled shards"""
+        cursor = self.db.execute("UPDATE shards SET status = ? WHERE status = ?", (CANCELLED, PENDING))
+        return cursor.rowcount
+
+    def uncancel(self):
+        """Return all cancelled shards to the pending pool. Returns the number of shards"""
+        cursor = self.db.execute("UPDATE shards SET status = ? WHERE status = ?", (PENDING, CANCELLED))
+        return cursor.rowcount
+
+    def status(self):
+        """Returns a dictionary with the number of shards per status"""
+        counts = { PENDING: 0, CLAIMED: 0, DONE: 0, CANCELLED: 0 }
+        for status, count in self.db.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def results(self, side):
+        """Iterate over the (firstline, lastline, result) of all finished shards for the specified side, in order"""
+        for firstline, lastline, result in self.db.execute("SELECT firstline, lastline, result FROM shards WHERE side = ? AND status = ? ORDER BY firstline", (side, DONE)):
+            yield firstline, lastline, json.loads(result)
+
+    def cancelled(self, side):
+        """Iterate over the (firstline, lastline) of all cancelled shards for the specified side, in order"""
+        for firstline, lastline in self.db.execute("SELECT firstline, lastline FROM shards WHERE side = ? AND status = ? ORDER BY firstline", (side, CANCELLED)):
+            yield firstline, lastline
+
+class Heartbeat(threading.Thread):
+    """Background thread that keeps the heartbeat of a claimed shard alive while a worker processes it"""
+
+    def __init__(self, queue, shard_id, worker, interval):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.shard_id = shard_id
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        db = self.queue.connect()
+        try:
+            while not self.stopped.wait(self.interval):
+                self.queue.heartbeat(self.shard_id, self.worker, db)
+        finally:
+            db.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def workerid():
+    """Returns an identifier for the current worker process"""
+    return socket.gethostname() + ":" + str(os.getpid())
+
+def makeshards(side, linecount, shardsize, start=0):
+    """Split the specified number of lines, starting at line start, into line-range shards (lastline inclusive)"""
+    return [ (side, firstline, min(firstline + shardsize, start + linecount) - 1) for firstline in range(start, start + linecount, shardsize) ]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Startup time benchmark for the babelente command line tool.
+
+Runs babelente in each mode on a small generated input, without making any queries (modes that would query BabelFy run
+with --max-requests 0), and reports the wall time per mode against its budget. It also checks that each mode loads only
+the subsystems it needs. Exits with status 1 if a mode is over budget or loads a subsystem it should not.
+
+Usage: python3 benchmarks/startup.py [--repeat N] [--factor F]"""
+
+import sys
+import os
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+
+#the heavy subsystems, imported only when a mode needs them
+SUBSYSTEMS = ('numpy', 'requests', 'babelpy', 'folia')
+
+#mode => (arguments, budget in seconds (including interpreter startup), subsystems the mode may load)
+MODES = {
+    'help': (['--help'], 0.15, ()),
+    'dryrun': (['-s','en','-t','nl','-S','{source}','-T','{target}','--dryrun'], 0.2, ()),
+    'evalfile': (['-k','BENCHMARK','-s','en','-t','nl','-S','{source}','-T','{target}','--evalfile','{evalfile}'], 0.2, ()),
+    'extract': (['-k','BENCHMARK','-s','en','-S','{source}','--max-requests','0'], 0.25, ('babelpy',)),
+    'evaluate': (['-k','BENCHMARK','-s','en','-t','nl','-S','{source}','-T','{target}','--max-requests','0'], 0.25, ('babelpy',)),
+    'lines': (['-k','BENCHMARK','-s','en','-S','{source}','--lines','0:10','--max-requests','0'], 0.4, ('babelpy','numpy')),
+    'folia': (['-k','BENCHMARK','-s','en','-o','{tmpdir}','--max-requests','0','{foliadoc}'], 0.5, ('babelpy','folia')),
+}
+
+def command(args):
+    #the same entry point as the babelente console script
+    return [sys.executable, '-c', 'from babelente.babelente import main; main()'] + args
+
+def prepare(tmpdir):
+    """Generate the input files, returns a dictionary for filling in the arguments"""
+    files = {'tmpdir': tmpdir}
+    files['source'] = os.path.join(tmpdir, 'source.txt')
+    files['target'] = os.path.join(tmpdir, 'target.txt')
+    with open(files['source'], 'w', encoding='utf-8') as f:
+        for i in range(100):
+            f.write("Sentence " + str(i) + " about Paris.\n")
+    with open(files['target'], 'w', encoding='utf-8') as f:
+        for i in range(100):
+            f.write("Zin " + str(i) + " over Parijs.\n")
+    files['evalfile'] = os.path.join(tmpdir, 'evaluation.json')
+    entity = {'babelSynsetID': 'bn:00015867n', 'isEntity': True, 'text': "Paris", 'start': 0, 'end': 4, 'offset': 0}
+    with open(files['evalfile'], 'w', encoding='utf-8') as f:
+        json.dump({'sourceentities': [ dict(entity, linenr=i) for i in range(100) ], 'targetentities': [ dict(entity, linenr=i) for i in range(100) ]}, f)
+    files['foliadoc'] = os.path.join(tmpdir, 'document.folia.xml')
+    with open(files['foliadoc'], 'w', encoding='utf-8') as f:
+        f.write("""<?xml version="1.0" encoding="utf-8"?>
+<FoLiA xmlns="http://ilk.uvt.nl/folia" xml:id="document" version="2.0.0">
+  <metadata type="native"><annotations><text-annotation/><sentence-annotation/><token-annotation/></annotations></metadata>
+  <text xml:id="document.text"><s xml:id="document.s.1"><w xml:id="document.s.1.w.1"><t>Paris</t></w><w xml:id="document.s.1.w.2"><t>is</t></w><w xml:id="document.s.1.w.3"><t>nice</t></w></s></text>
+</FoLiA>
+""")
+    return files
+
+def loadedsubsystems(args):
+    """Run babelente once with -X importtime and return the subsystems it loaded"""
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + command(args)[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    loaded = set()
+    for line in process.stderr.split("\n"):
+        if line.startswith("import time:") and line.count("|") == 2:
+            module = line.split("|")[2].strip().split(".")[0]
+            if module in SUBSYSTEMS:
+                loaded.add(module)
+    return loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark for babelente", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--repeat', type=int, help="Number of runs per mode (the median is reported)", action='store', default=5, required=False)
+    parser.add_argument('--factor', type=float, help="Multiply all budgets by this factor (for slower machines)", action='store', default=1.0, required=False)
+    parser.add_argument('modes', nargs='*', help="Modes to benchmark (default: all): " + ", ".join(MODES))
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.pop('BABELNET_API_KEYS', None)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = prepare(tmpdir)
+        print("MODE\tMEDIAN(s)\tBUDGET(s)\tSUBSYSTEMS\tSTATUS")
+        for mode in args.modes or MODES:
+            modeargs, modebudget, allowed = MODES[mode]
+            modeargs = [ arg.format(**files) for arg in modeargs ]
+            durations = []
+            for _ in range(args.repeat):
+                begintime = time.time()
+                process = subprocess.run(command(modeargs), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+                durations.append(time.time() - begintime)
+                if process.returncode != 0:
+                    print("ERROR: mode " + mode + " failed (exit code " + str(process.returncode) + "): " + " ".join(command(modeargs)), file=sys.stderr)
+                    sys.exit(2)
+            durations.sort()
+            median = durations[len(durations) // 2]
+            loaded = loadedsubsystems(modeargs)
+            status = []
+            if median > modebudget * args.factor:
+                status.append("OVER BUDGET")
+            if loaded - set(allowed):
+                status.append("UNEXPECTED " + ",".join(sorted(loaded - set(allowed))))
+            failed = failed or bool(status)
+            print(mode + "\t" + str(round(median, 3)) + "\t" + str(round(modebudget * args.factor, 3)) + "\t" + (",".join(sorted(loaded)) or "-") + "\t" + ("; ".join(status) or "OK"))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""A stand-in for babelpy's BabelfyClient for the tests: it links the words in LEXICON (at token boundaries) and counts its queries"""
+
+import re
+from unittest import mock
+
+LEXICON = {
+    'Paris': 'bn:00015867n',
+    'Parijs': 'bn:00015867n',
+    'London': 'bn:00018215n',
+    'Londen': 'bn:00018215n',
+}
+
+class FakeBabelfyClient:
+    queries = [] #texts queried, over all clients
+    rejected = {} #key => message returned instead of entities
+
+    def __init__(self, key, params=None):
+        self.key = key
+        self._data = []
+        self.entities = []
+
+    def babelfy(self, text, params=None):
+        FakeBabelfyClient.queries.append(text)
+        if self.key in FakeBabelfyClient.rejected:
+            self._data = {'message': FakeBabelfyClient.rejected[self.key]}
+            self.entities = []
+            return
+        self._data = []
+        self.entities = []
+        for match in re.finditer(r"\w+", text):
+            if match.group(0) in LEXICON:
+                tokennr = text[:match.start()].count(" ")
+                self.entities.append({
+                    'start': match.start(),
+                    'end': match.end() - 1,
+                    'text': match.group(0),
+                    'isEntity': True,
+                    'babelSynsetID': LEXICON[match.group(0)],
+                    'tokenFragment': {'start': tokennr, 'end': tokennr},
+                    'charFragment': {'start': match.start(), 'end': match.end() - 1},
+                    'score': 1.0, 'coherenceScore': 0.5, 'globalScore': 0.1,
+                })
+
+def fakebabelfy():
+    """Patch babelpy to use the fake client (use as a context manager), resets the query log"""
+    FakeBabelfyClient.queries = []
+    FakeBabelfyClient.rejected = {}
+    return mock.patch('babelpy.babelfy.BabelfyClient', FakeBabelfyClient)
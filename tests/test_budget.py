@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for runs bounded by the budget: which lines are processed, skipped and evaluated"""
+
+import io
+import os
+import sys
+import json
+import unittest
+import tempfile
+import contextlib
+from unittest import mock
+
+from babelente import babelente, BabelEnte
+from babelente.budget import Budget, BudgetExhausted, lineranges, complementranges
+from fakebabelfy import FakeBabelfyClient, fakebabelfy
+
+#each line is long enough to fill a chunk by itself, so extraction makes one query per line and side
+SOURCELINES = [ "Paris " + str(i) + " " + "x" * 2100 for i in range(10) ]
+TARGETLINES = [ "Parijs " + str(i) + " " + "y" * 2100 for i in range(10) ]
+
+def findtranslations(synset_id, lang, apikey, cache=None, debug=False, session=None, keypool=None, budget=None, progress=None):
+    """Fake getSynset lookup, charged to the budget like a real one"""
+    budget.charge()
+    return [ "lemma" ]
+
+class TestLineRanges(unittest.TestCase):
+
+    def test_lineranges(self):
+        self.assertEqual(lineranges([]), [])
+        self.assertEqual(lineranges({5, 1, 2, 3, 8}), [[1, 4], [5, 6], [8, 9]])
+
+    def test_complementranges(self):
+        self.assertEqual(complementranges(set(), 10, 20), [[10, 20]])
+        self.assertEqual(complementranges({10, 11, 15, 19}, 10, 20), [[12, 15], [16, 19]])
+        self.assertEqual(complementranges(set(range(10, 20)), 10, 20), [])
+        #skipped lines outside the range are ignored
+        self.assertEqual(complementranges({2, 25}, 10, 20), [[10, 20]])
+
+class TestBoundedExtraction(unittest.TestCase):
+
+    def test_skipped(self):
+        """Source and target are extracted alternately, so the budget leaves both sides covering about the same lines"""
+        engine = BabelEnte(apikey="TEST", budget=Budget(maxrequests=9))
+        skipped = {'source': set(), 'target': set()}
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            sourceentities, targetentities = engine.extract_parallel(SOURCELINES, TARGETLINES, "EN", "NL", 100, skipped)
+            self.assertEqual(len(FakeBabelfyClient.queries), 9)
+        self.assertEqual(skipped, {'source': set(range(105, 110)), 'target': set(range(104, 110))})
+        self.assertEqual([ entity['linenr'] for entity in sourceentities ], list(range(100, 105)))
+        self.assertEqual([ entity['linenr'] for entity in targetentities ], list(range(100, 104)))
+
+    def test_recalllines(self):
+        """Lines are only evaluated when both sides were processed, recall only for the lines whose synsets could be checked within the budget"""
+        engine = BabelEnte(apikey="TEST", budget=Budget(maxrequests=12))
+        skipped = {'source': set(), 'target': set()}
+        with fakebabelfy(), mock.patch.object(babelente, 'findtranslations', findtranslations), contextlib.redirect_stderr(io.StringIO()):
+            sourceentities, targetentities = engine.extract_parallel(SOURCELINES[:5], TARGETLINES[:5], "EN", "NL", 0, skipped)
+            evaluation = engine.evaluate(sourceentities, targetentities, SOURCELINES[:5], TARGETLINES[:5], "NL", recall=True, skip=skipped['source'] | skipped['target'])
+        self.assertEqual(evaluation['coverage'], {'lines': 5, 'evaluatedlines': 5, 'recalllines': 2})
+        self.assertEqual(sorted( linenr for linenr, line in evaluation['perline'].items() if 'recall' in line ), [0, 1])
+
+class TestBoundedRun(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = {}
+        for side, lines in (('source', SOURCELINES), ('target', TARGETLINES)):
+            self.files[side] = os.path.join(self.tmpdir.name, side + ".txt")
+            with open(self.files[side], 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_main(self, *arguments):
+        argv = ["babelente", "-k", "TEST", "-s", "en", "-t", "nl", "-S", self.files['source'], "-T", self.files['target'], "--recall"] + list(arguments)
+        with fakebabelfy(), mock.patch.object(sys, 'argv', argv), mock.patch.object(babelente, 'findtranslations', findtranslations), \
+                contextlib.redirect_stdout(io.StringIO()) as stdout, contextlib.redirect_stderr(io.StringIO()):
+            babelente.main()
+        output, _ = json.JSONDecoder().raw_decode(stdout.getvalue())
+        return output
+
+    def test_maxrequests(self):
+        """The coverage of a run bounded by --max-requests: processed and skipped lines per side and the lines evaluated"""
+        output = self.run_main("--max-requests", "9")
+        coverage = output['coverage']
+        self.assertEqual(coverage['stopped'], 'maxrequests')
+        self.assertEqual(coverage['requests'], 9)
+        self.assertEqual(coverage['source'], {'lines': 10, 'processedlines': 5, 'processed': [[0, 5]], 'skipped': [[5, 10]]})
+        self.assertEqual(coverage['target'], {'lines': 10, 'processedlines': 4, 'processed': [[0, 4]], 'skipped': [[4, 10]]})
+        #the budget is used up by extraction, so recall is computed for none of the evaluated lines
+        self.assertEqual(output['evaluation']['coverage'], {'lines': 10, 'evaluatedlines': 4, 'recalllines': 0})
+        self.assertEqual(sorted( int(linenr) for linenr in output['evaluation']['perline'] ), [0, 1, 2, 3])
+
+    def test_lines(self):
+        """With --lines, the coverage is in global line numbers"""
+        output = self.run_main("--max-requests", "3", "--lines", "4:8")
+        self.assertEqual(output['coverage']['source']['processed'], [[4, 6]])
+        self.assertEqual(output['coverage']['target']['processed'], [[4, 5]])
+        self.assertEqual(output['evaluation']['coverage'], {'lines': 4, 'evaluatedlines': 1, 'recalllines': 0})
+
+    def test_unbounded(self):
+        """Without a budget, all lines are processed and no coverage is reported"""
+        output = self.run_main()
+        self.assertNotIn('coverage', output)
+        self.assertNotIn('coverage', output['evaluation'])
+        self.assertEqual(len(output['evaluation']['perline']), 10)
+
+if __name__ == '__main__':
+    unittest.main()
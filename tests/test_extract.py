@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for entity extraction with the engine, against a fake BabelFy client"""
+
+import io
+import unittest
+import contextlib
+
+from babelente import BabelEnte
+from fakebabelfy import FakeBabelfyClient, fakebabelfy
+
+#each line is long enough that two lines fill a chunk, so lines 0-1 and 2-3 form two chunks with the same text
+LONGLINE = "Paris " + "x" * 1900
+REPEATED = [ LONGLINE, "London " + "y" * 1900, LONGLINE, "London " + "y" * 1900 ]
+
+class TestExtract(unittest.TestCase):
+
+    def extract(self, engine, lines, *args, **kwargs):
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            return list(engine.extract(lines, "EN", *args, **kwargs))
+
+    def test_repeatedchunks(self):
+        """Chunks with the same text are queried once and each gets its own line numbers"""
+        engine = BabelEnte(apikey="TEST")
+        entities = self.extract(engine, REPEATED)
+        self.assertEqual([ entity['linenr'] for entity in entities ], [0, 1, 2, 3])
+        self.assertEqual(len(FakeBabelfyClient.queries), 1)
+
+    def test_repeatedchunks_locallinker(self):
+        """The same with the local linker, which passes the lines it can not resolve on to BabelFy"""
+        engine = BabelEnte(apikey="TEST", locallinker=True)
+        entities = self.extract(engine, REPEATED)
+        self.assertEqual([ entity['linenr'] for entity in entities ], [0, 1, 2, 3])
+
+    def test_noaliasing(self):
+        """Entities returned by one call are not changed by later calls that hit the same cache entries"""
+        engine = BabelEnte(apikey="TEST")
+        first = self.extract(engine, ["Paris is nice."])
+        self.extract(engine, ["Paris is nice."], firstlinenr=10)
+        self.assertEqual(first[0]['linenr'], 0)
+        for entities in engine.cache['source'].values():
+            for entity in entities:
+                self.assertNotIn('linenr', entity)
+
+class TestExtractParallel(unittest.TestCase):
+
+    def extract_parallel(self, engine, sourcelines, targetlines, firstlinenr=0, skipped=None):
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            return engine.extract_parallel(sourcelines, targetlines, "EN", "NL", firstlinenr, skipped)
+
+    def test_repeatedchunks(self):
+        """Chunks with the same text on one side each get their own line numbers"""
+        engine = BabelEnte(apikey="TEST")
+        sourceentities, targetentities = self.extract_parallel(engine, REPEATED, [ line.replace("London", "Londen") for line in REPEATED ])
+        self.assertEqual([ entity['linenr'] for entity in sourceentities ], [0, 1, 2, 3])
+        self.assertEqual([ entity['linenr'] for entity in targetentities ], [0, 1, 2, 3])
+
+    def test_sameasextract(self):
+        """extract_parallel() gives the same entities (with global line numbers) as extract() per side, with the same queries"""
+        sourcelines = [ "Line " + str(i) + " about Paris and London, with some more words." for i in range(300) ]
+        targetlines = [ "Regel " + str(i) + " over Parijs en Londen, met nog wat woorden." for i in range(300) ]
+        engine = BabelEnte(apikey="TEST")
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            sourceentities = list(engine.extract(sourcelines, "EN", 'source', 5))
+            targetentities = list(engine.extract(targetlines, "NL", 'target', 5))
+            queries = sorted(FakeBabelfyClient.queries)
+        engine = BabelEnte(apikey="TEST")
+        skipped = {'source': set(), 'target': set()}
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(engine.extract_parallel(sourcelines, targetlines, "EN", "NL", 5, skipped), (sourceentities, targetentities))
+            self.assertEqual(sorted(FakeBabelfyClient.queries), queries)
+        self.assertEqual(skipped, {'source': set(), 'target': set()})
+
+if __name__ == '__main__':
+    unittest.main()
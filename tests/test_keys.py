@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for failing over to the next API key when BabelFy or BabelNet rejects a key"""
+
+import io
+import unittest
+import contextlib
+
+from babelente import babelente
+from babelente.keypool import KeyPool
+from fakebabelfy import FakeBabelfyClient, fakebabelfy
+
+REJECTED = "Your key is not valid or the daily requests limit has been reached. Please visit http://babelfy.org."
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+class FakeSession:
+    """Answers getSynset requests with the response set for the key"""
+
+    def __init__(self, responses):
+        self.responses = responses #key => FakeResponse
+        self.keys = []
+
+    def get(self, url, params=None):
+        self.keys.append(params['key'])
+        return self.responses[params['key']]
+
+def makekeypool(*keys):
+    keypool = KeyPool()
+    for key in keys:
+        keypool.add(key)
+    return keypool
+
+class TestQueryBabelfy(unittest.TestCase):
+
+    def query(self, keypool):
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            FakeBabelfyClient.rejected['KEY1'] = self.message
+            return babelente.querybabelfy({}, {'lang': 'EN'}, "Paris", keypool=keypool)
+
+    def test_rejectedkey(self):
+        """A key rejected for its quota is not used again and the query goes to the next key"""
+        self.message = REJECTED
+        keypool = makekeypool('KEY1', 'KEY2')
+        entities = self.query(keypool)
+        self.assertEqual([ entity['babelSynsetID'] for entity in entities ], ['bn:00015867n'])
+        self.assertEqual(list(keypool.rejected), ['KEY1'])
+
+    def test_error(self):
+        """Any other message is an error of the query, the key is not rejected"""
+        self.message = "Invalid parameter: lang"
+        keypool = makekeypool('KEY1', 'KEY2')
+        with self.assertRaises(RuntimeError):
+            self.query(keypool)
+        self.assertEqual(keypool.rejected, {})
+
+class TestFindTranslations(unittest.TestCase):
+
+    SYNSET = {'senses': [{'lemma': 'Parijs', 'language': 'NL'}]}
+
+    def translate(self, session, keypool):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return list(babelente.findtranslations("bn:00015867n", "NL", None, session=session, keypool=keypool))
+
+    def test_rejectedkey(self):
+        """Keys rejected by message or by HTTP status are not used again"""
+        session = FakeSession({'KEY1': FakeResponse(200, {'message': REJECTED}), 'KEY2': FakeResponse(429, None), 'KEY3': FakeResponse(200, self.SYNSET)})
+        keypool = makekeypool('KEY1', 'KEY2', 'KEY3')
+        self.assertEqual(self.translate(session, keypool), ['Parijs'])
+        self.assertEqual(sorted(keypool.rejected), ['KEY1', 'KEY2'])
+
+    def test_error(self):
+        """Any other message is an error of the query, the key is not rejected"""
+        session = FakeSession({'KEY1': FakeResponse(200, {'message': "Invalid synset ID"}), 'KEY2': FakeResponse(200, self.SYNSET)})
+        keypool = makekeypool('KEY1', 'KEY2')
+        with self.assertRaises(RuntimeError):
+            self.translate(session, keypool)
+        self.assertEqual(keypool.rejected, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for the line-offset index and reading line ranges with it"""
+
+import io
+import os
+import unittest
+import tempfile
+import contextlib
+from unittest import mock
+
+from babelente import babelente
+from babelente.lineindex import buildlineindex, loadlineindex, linecount, indexfilename
+
+class TestLineIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, data):
+        filename = os.path.join(self.tmpdir.name, "input.txt")
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def test_lines(self):
+        filename = self.write("Paris is nice.\nLondon is big.\n\nBerlin.\n".encode('utf-8'))
+        index = loadlineindex(filename)
+        self.assertEqual(linecount(index), 4)
+        self.assertEqual(babelente.readlinerange(filename, 0, 3, index), ["Paris is nice.", "London is big.", "", "Berlin."])
+        self.assertEqual(babelente.readlinerange(filename, 1, 2, index), ["London is big.", ""])
+        self.assertTrue(os.path.exists(indexfilename(filename)))
+
+    def test_notrailingnewline(self):
+        filename = self.write("Paris\nLondon".encode('utf-8'))
+        index = loadlineindex(filename)
+        self.assertEqual(linecount(index), 2)
+        self.assertEqual(babelente.readlinerange(filename, 1, 1, index), ["London"])
+
+    def test_emptyfile(self):
+        filename = self.write(b"")
+        index = loadlineindex(filename)
+        self.assertEqual(linecount(index), 0)
+        self.assertEqual(babelente.readlinerange(filename, 0, 10, index), [])
+
+    def test_carriagereturn(self):
+        """Only newlines end lines, a lone carriage return does not, a carriage return before a newline is stripped"""
+        filename = self.write("Paris\rLondon\r\nBerlin\n".encode('utf-8'))
+        index = loadlineindex(filename)
+        self.assertEqual(linecount(index), 2)
+        self.assertEqual(babelente.readlinerange(filename, 0, 1, index), ["Paris\rLondon", "Berlin"])
+
+    def test_outofrange(self):
+        """Ranges past the end of the file are cut short"""
+        filename = self.write("Paris\nLondon\n".encode('utf-8'))
+        index = loadlineindex(filename)
+        self.assertEqual(babelente.readlinerange(filename, 1, 10, index), ["London"])
+        self.assertEqual(babelente.readlinerange(filename, 5, 10, index), [])
+
+    def test_outofdate(self):
+        """The index is rebuilt when the file changed"""
+        filename = self.write("Paris\n".encode('utf-8'))
+        loadlineindex(filename)
+        self.write("Paris\nLondon\n".encode('utf-8'))
+        os.utime(indexfilename(filename), (0, 0))
+        self.assertIsNone(loadlineindex(filename, build=False))
+        self.assertEqual(linecount(loadlineindex(filename)), 2)
+
+    def test_unwritable(self):
+        """If the index can not be saved alongside the file, it is kept in memory"""
+        filename = self.write("Paris\nLondon\n".encode('utf-8'))
+        with mock.patch('os.replace', side_effect=PermissionError("Permission denied")), contextlib.redirect_stderr(io.StringIO()) as stderr:
+            index = buildlineindex(filename)
+        self.assertIn("WARNING", stderr.getvalue())
+        self.assertEqual(babelente.readlinerange(filename, 0, 1, index), ["Paris", "London"])
+        self.assertEqual(os.listdir(self.tmpdir.name), ["input.txt"])
+
+class TestParseLineRange(unittest.TestCase):
+
+    def test_range(self):
+        self.assertEqual(babelente.parselinerange("2:5", 10), (2, 5))
+        self.assertEqual(babelente.parselinerange(":5", 10), (0, 5))
+        self.assertEqual(babelente.parselinerange("2:", 10), (2, 10))
+        self.assertEqual(babelente.parselinerange(":", 10), (0, 10))
+
+    def test_outofrange(self):
+        """An end past the end of the file is cut short, a start past it is invalid"""
+        self.assertEqual(babelente.parselinerange("2:50", 10), (2, 10))
+        self.assertEqual(babelente.parselinerange("10:", 10), (10, 10))
+        for spec in ("11:", "-1:5", "5:2", "5", "a:b"):
+            with self.assertRaises(ValueError, msg=spec):
+                babelente.parselinerange(spec, 10)
+
+if __name__ == '__main__':
+    unittest.main()
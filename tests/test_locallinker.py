@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for the local lexicon-based entity linker"""
+
+import io
+import argparse
+import unittest
+import contextlib
+
+from babelente import babelente
+from babelente.locallinker import LocalLinker
+from fakebabelfy import FakeBabelfyClient, fakebabelfy
+
+def entity(text, start, synset_id, score=1.0):
+    return {'text': text, 'start': start, 'end': start + len(text) - 1, 'isEntity': True, 'babelSynsetID': synset_id, 'score': score, 'coherenceScore': 0.5, 'globalScore': 0.1}
+
+def makecache(n=5):
+    """A cache of n chunks in which 'New York' and 'Paris' are always linked, 'London' only once"""
+    cache = {}
+    for i in range(n):
+        text = "I went from New York to Paris " + str(i)
+        cache[text] = [ entity("New York", 12, 'bn:newyork'), entity("Paris", 24, 'bn:paris') ]
+    cache["London and Paris"] = [ entity("London", 0, 'bn:london'), entity("Paris", 11, 'bn:paris') ]
+    for i in range(n):
+        cache["London calling " + str(i)] = []
+    return cache
+
+class TestLocalLinker(unittest.TestCase):
+
+    def setUp(self):
+        self.linker = LocalLinker.fromcache(makecache(), threshold=0.9, minsupport=5)
+
+    def test_multitoken(self):
+        """Surface forms of multiple tokens are matched through the trie, with offsets in the line"""
+        entities = self.linker.link("I went from New York to Paris")
+        self.assertEqual([ (e['text'], e['start'], e['end'], e['babelSynsetID']) for e in entities ], [("New York", 12, 19, 'bn:newyork'), ("Paris", 24, 28, 'bn:paris')])
+        self.assertTrue(all(e['source'] == 'LOCAL' for e in entities))
+
+    def test_partialsurface(self):
+        """A prefix of a surface form alone is not a match, and 'New' was never seen without a link, so the line is deferred"""
+        self.assertIsNone(self.linker.link("I went from New to Paris"))
+
+    def test_threshold(self):
+        """A surface form linked in too few of its occurrences is not linked locally: the line is deferred"""
+        self.assertEqual(self.linker.confidence("London")[0], 'bn:london')
+        self.assertLess(self.linker.confidence("London")[1], 0.9)
+        self.assertIsNone(self.linker.link("London to Paris"))
+
+    def test_minsupport(self):
+        """A surface form seen fewer than minsupport times is not linked locally"""
+        linker = LocalLinker.fromcache(makecache(), threshold=0.9, minsupport=10)
+        self.assertIsNone(linker.link("I went from New York to Paris"))
+
+    def test_unknownword(self):
+        """Lines with words never seen in the cache are deferred"""
+        self.assertIsNone(self.linker.link("I went from New York to Berlin"))
+
+    def test_rarewordnolink(self):
+        """A line without any known surface form is only resolved (with no entities) if all its words have often been seen unlinked"""
+        cache = makecache()
+        cache["Nothing to see"] = []
+        linker = LocalLinker.fromcache(cache, threshold=0.9, minsupport=5)
+        self.assertIsNone(linker.link("Nothing to see"))
+        self.assertEqual(linker.link("I went to"), [])
+
+class TestLinkEntities(unittest.TestCase):
+
+    def test_avoidedrequests(self):
+        """Lines resolved locally are not sent to BabelFy, the deferred lines are chunked anew and the avoided requests are counted"""
+        cache = makecache()
+        args = argparse.Namespace(**dict(babelente.ENGINEOPTIONS, apikey="TEST"))
+        linker = LocalLinker.fromcache(cache, threshold=0.9, minsupport=5)
+        #three chunks of two lines each: two can be resolved locally entirely, in the third the first line has an unknown word
+        padding = " to" * 700
+        lines = [ "I went from New York to Paris" + padding, "I went to Paris",
+                  "I went from New York to Paris" + padding, "I went to New York",
+                  "I went from New York to Berlin" + padding, "I went to Paris" ]
+        with fakebabelfy(), contextlib.redirect_stderr(io.StringIO()):
+            entities = babelente.linkentities(lines, "EN", args, linker, cache)
+        self.assertEqual(FakeBabelfyClient.queries, [ lines[4] ])
+        self.assertEqual(linker.stats()['resolvedlines'], 5)
+        self.assertEqual(linker.stats()['deferredlines'], 1)
+        self.assertEqual(linker.stats()['avoidedrequests'], 2)
+        self.assertEqual(linker.stats()['avoidedbytes'], sum(len(line) for i, line in enumerate(lines) if i != 4))
+        self.assertEqual([ (e['linenr'], e['text']) for e in entities ], [(0, "New York"), (0, "Paris"), (1, "Paris"), (2, "New York"), (2, "Paris"), (3, "New York"), (5, "Paris")])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for planning a run (--dryrun): the getSynset calls planned for recall"""
+
+import io
+import random
+import argparse
+import unittest
+import contextlib
+from collections import Counter
+
+from babelente import babelente
+
+def makeargs(**kwargs):
+    args = argparse.Namespace(recall=True, targetlang='nl', recallsample=None, recallsamplerate=None, recallstratify=False, ratelimit=None)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+#re-evaluation of 40 distinct synsets in 20 frequency bands
+SOURCEENTITIES = [ {'babelSynsetID': "bn:" + str(i).zfill(8) + "n", 'linenr': 0} for i in range(40) for _ in range(2 ** (i % 20)) ]
+
+class TestPlanRecall(unittest.TestCase):
+
+    def plan(self, sourcelines, targetlines, args, sourceentities=None):
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            plan = babelente.planrun(sourcelines, targetlines, args, None, sourceentities)
+        return plan, stderr.getvalue()
+
+    def test_notarget(self):
+        """Without target lines there is nothing to evaluate, so no recall is planned"""
+        plan, warnings = self.plan(["Paris is nice."], None, makeargs())
+        self.assertEqual(plan['getsynset'], 0)
+        self.assertTrue(plan['durationincludesrecall'])
+        self.assertEqual(warnings, "")
+
+    def test_unknown(self):
+        """With target lines but nothing cached, the getSynset calls are unknown"""
+        plan, warnings = self.plan(["Paris is nice."], ["Parijs is mooi."], makeargs())
+        self.assertIsNone(plan['getsynset'])
+        self.assertIn("WARNING", warnings)
+
+    def test_reevaluation(self):
+        """All distinct synsets are checked for recall when re-evaluating"""
+        plan, _ = self.plan([""], [""], makeargs(), SOURCEENTITIES)
+        self.assertEqual(plan['getsynset'], 40)
+
+    def test_stratifiedsample(self):
+        """A stratified sample is planned as the number of synsets evaluation actually checks"""
+        synsetfreq = Counter( entity['babelSynsetID'] for entity in SOURCEENTITIES )
+        for recallsample in (5, 30, 100):
+            plan, _ = self.plan([""], [""], makeargs(recallsample=recallsample, recallstratify=True), SOURCEENTITIES)
+            with contextlib.redirect_stderr(io.StringIO()):
+                _, sampled = babelente.samplesynsets(synsetfreq, babelente.recallsamplesize(len(synsetfreq), recallsample), True, random.Random(1))
+            self.assertEqual(plan['getsynset'], len(sampled))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for sampled recall estimation: the estimate is compared against the exact recall of a full evaluation on
+synthetic data, with the translatability lookup mocked."""
+
+import io
+import random
+import unittest
+import contextlib
+from unittest import mock
+from collections import Counter
+
+from babelente import babelente
+
+class SyntheticCorpus:
+    """Synthetic source/target entities, a fixed fraction of the synsets is translatable and only entities of
+    translatable synsets are (sometimes) matched in the target"""
+
+    def __init__(self, lines=400, synsets=300, translatablerate=0.7, matchrate=0.6, seed=1):
+        rng = random.Random(seed)
+        self.synsets = [ "bn:" + str(i).zfill(8) + "n" for i in range(synsets) ]
+        weights = [ 1 / (rank + 20) for rank in range(synsets) ] #skewed, but without a single dominating synset
+        self.translatable = { synset_id for synset_id in self.synsets if rng.random() < translatablerate }
+        self.sourcelines = []
+        self.targetlines = []
+        self.sourceentities = []
+        self.targetentities = []
+        for linenr in range(lines):
+            self.sourcelines.append("x" * 80)
+            self.targetlines.append("y" * 80)
+            for i in range(rng.randint(1,6)):
+                synset_id = rng.choices(self.synsets, weights)[0]
+                self.sourceentities.append(self.entity(synset_id, linenr, i))
+                if synset_id in self.translatable and rng.random() < matchrate:
+                    self.targetentities.append(self.entity(synset_id, linenr, i))
+            if rng.random() < 0.3:
+                self.targetentities.append(self.entity(rng.choice(self.synsets), linenr, 7))
+
+    @staticmethod
+    def entity(synset_id, linenr, i):
+        return {'babelSynsetID': synset_id, 'isEntity': True, 'text': synset_id, 'linenr': linenr, 'start': 0, 'end': 4, 'offset': i * 10}
+
+    def findtranslations(self, synset_id, lang, *args, **kwargs):
+        return [ "lemma" ] if synset_id in self.translatable else []
+
+    def evaluate(self, **kwargs):
+        with mock.patch.object(babelente, 'findtranslations', self.findtranslations), contextlib.redirect_stderr(io.StringIO()):
+            return babelente.evaluate(self.sourceentities, self.targetentities, self.sourcelines, self.targetlines, True, 'nl', "", False, **kwargs)
+
+class TestRecallEstimate(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = SyntheticCorpus()
+        cls.exact = cls.corpus.evaluate()
+
+    def test_bounded(self):
+        """The estimated recall never exceeds 1, per line nor overall"""
+        for seed in range(10):
+            evaluation = self.corpus.evaluate(recallsamplerate=0.1, seed=seed)
+            self.assertLessEqual(evaluation['recall'], 1.0)
+            self.assertLessEqual(evaluation['microrecall'], 1.0)
+            self.assertLessEqual(evaluation['recallestimate']['recall_ci'][1], 1.0)
+            self.assertLessEqual(evaluation['recallestimate']['microrecall_ci'][1], 1.0)
+            self.assertGreaterEqual(evaluation['translatableentities'], evaluation['matches'])
+            for linenr, line in evaluation['perline'].items():
+                self.assertLessEqual(line['recall'], 1.0, "line " + str(linenr))
+
+    def test_estimate(self):
+        """The estimate is unbiased and its confidence interval usually covers the exact recall"""
+        covered = microcovered = 0
+        errors = []
+        microerrors = []
+        seeds = range(20)
+        for seed in seeds:
+            estimate = self.corpus.evaluate(recallsamplerate=0.3, seed=seed)
+            errors.append(estimate['recall'] - self.exact['recall'])
+            microerrors.append(estimate['microrecall'] - self.exact['microrecall'])
+            low, high = estimate['recallestimate']['recall_ci']
+            covered += low <= self.exact['recall'] <= high
+            low, high = estimate['recallestimate']['microrecall_ci']
+            microcovered += low <= self.exact['microrecall'] <= high
+        self.assertLess(max(abs(error) for error in errors + microerrors), 0.15)
+        self.assertLess(abs(sum(errors) / len(errors)), 0.02)
+        self.assertLess(abs(sum(microerrors) / len(microerrors)), 0.02)
+        self.assertGreaterEqual(covered, 0.8 * len(seeds))
+        self.assertGreaterEqual(microcovered, 0.8 * len(seeds))
+
+    def test_stratified(self):
+        """Stratified sampling gives an estimate close to the exact recall as well"""
+        estimate = self.corpus.evaluate(recallsamplerate=0.3, stratify=True, seed=1)
+        self.assertAlmostEqual(estimate['recall'], self.exact['recall'], delta=0.15)
+        self.assertAlmostEqual(estimate['microrecall'], self.exact['microrecall'], delta=0.15)
+
+    def test_fullsample(self):
+        """Sampling all synsets gives the exact recall"""
+        estimate = self.corpus.evaluate(recallsamplerate=1.0, seed=1)
+        self.assertAlmostEqual(estimate['recall'], self.exact['recall'])
+        self.assertAlmostEqual(estimate['microrecall'], self.exact['microrecall'])
+
+class TestSampleSynsets(unittest.TestCase):
+
+    #frequencies 1-64 give seven frequency bands (log2 of the frequency)
+    SYNSETFREQ = { "bn:" + str(i).zfill(8) + "n": 1 + i % 64 for i in range(640) }
+
+    def sample(self, samplesize):
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            stratum, sampled = babelente.samplesynsets(self.SYNSETFREQ, samplesize, True, random.Random(1))
+        return stratum, sampled, stderr.getvalue()
+
+    def test_samplesize(self):
+        """A stratified sample never exceeds the sample size, and checks at least two synsets per band when it can"""
+        for samplesize in (14, 15, 50, 200, 640, 1000):
+            stratum, sampled, warnings = self.sample(samplesize)
+            self.assertEqual(len(sampled), min(samplesize, len(self.SYNSETFREQ)))
+            bands = Counter( stratum[synset_id] for synset_id in sampled )
+            self.assertEqual(len(bands), 7)
+            self.assertGreaterEqual(min(bands.values()), 2)
+            self.assertEqual(warnings, "")
+
+    def test_smallsample(self):
+        """A stratified sample smaller than two per band is not enlarged, but a warning is given"""
+        stratum, sampled, warnings = self.sample(5)
+        self.assertEqual(len(sampled), 5)
+        self.assertIn("WARNING", warnings)
+
+    def test_proportional(self):
+        """The rest of the sample is divided over the bands in proportion to their size"""
+        allocation = babelente.allocatesample({0: 100, 1: 10, 2: 2}, 24)
+        self.assertEqual(allocation, {0: 19, 1: 3, 2: 2})
+
+if __name__ == '__main__':
+    unittest.main()
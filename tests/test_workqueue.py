@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Maarten van Gompel (proycon)
+# Centre for Language and Speech Technology
+# Radboud University Nijmegen
+# GNU Public License v3
+
+"""Tests for the work queue of distributed extraction, and for resuming a published job with the coordinator"""
+
+import io
+import os
+import argparse
+import unittest
+import tempfile
+import contextlib
+
+from babelente import babelente
+from babelente.budget import Budget
+from babelente.workqueue import WorkQueue, makeshards, PENDING, CLAIMED, DONE, CANCELLED
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(os.path.join(self.tmpdir.name, "queue.sqlite"))
+        self.queue.publish({'source': "input.txt"}, makeshards('source', 25, 10))
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmpdir.cleanup()
+
+    def status(self, **expected):
+        counts = { PENDING: 0, CLAIMED: 0, DONE: 0, CANCELLED: 0 }
+        counts.update(expected)
+        self.assertEqual(self.queue.status(), counts)
+
+    def test_makeshards(self):
+        self.assertEqual(makeshards('source', 25, 10), [('source', 0, 9), ('source', 10, 19), ('source', 20, 24)])
+        self.assertEqual(makeshards('target', 5, 10, 100), [('target', 100, 104)])
+        self.assertEqual(makeshards('target', 0, 10), [])
+
+    def test_publish(self):
+        self.assertTrue(self.queue.published())
+        self.assertEqual(self.queue.params(), {'source': "input.txt"})
+        self.status(pending=3)
+
+    def test_claim(self):
+        """Shards are claimed in order, each by one worker only"""
+        self.assertEqual(self.queue.claim("A"), (1, 'source', 0, 9))
+        self.assertEqual(self.queue.claim("B"), (2, 'source', 10, 19))
+        self.assertEqual(self.queue.claim("A"), (3, 'source', 20, 24))
+        self.assertIsNone(self.queue.claim("B"))
+        self.status(claimed=3)
+
+    def test_complete(self):
+        shard_id = self.queue.claim("A")[0]
+        self.assertTrue(self.queue.complete(shard_id, "A", {'entities': [1]}))
+        self.assertFalse(self.queue.complete(shard_id, "A", {'entities': [2]}))
+        self.assertEqual(list(self.queue.results('source')), [(0, 9, {'entities': [1]})])
+        self.status(pending=2, done=1)
+
+    def test_reclaim(self):
+        """Shards of workers without a recent heartbeat return to the pending pool, others are left alone"""
+        self.queue.claim("A")
+        self.queue.claim("B")
+        self.queue.db.execute("UPDATE shards SET heartbeat = heartbeat - 100 WHERE worker = 'A'")
+        self.assertEqual(self.queue.reclaim(60), 1)
+        self.status(pending=2, claimed=1)
+        self.assertEqual(self.queue.claim("C"), (1, 'source', 0, 9))
+
+    def test_completeafterreclaim(self):
+        """A worker whose shard was reclaimed and given to another worker can not complete it any more"""
+        shard_id = self.queue.claim("A")[0]
+        self.queue.db.execute("UPDATE shards SET heartbeat = heartbeat - 100")
+        self.queue.reclaim(60)
+        self.assertEqual(self.queue.claim("B")[0], shard_id)
+        self.assertFalse(self.queue.complete(shard_id, "A", {'entities': ["A"]}))
+        self.assertTrue(self.queue.complete(shard_id, "B", {'entities': ["B"]}))
+        self.assertEqual(list(self.queue.results('source')), [(0, 9, {'entities': ["B"]})])
+
+    def test_heartbeat(self):
+        """A heartbeat keeps a shard from being reclaimed"""
+        shard_id = self.queue.claim("A")[0]
+        self.queue.db.execute("UPDATE shards SET heartbeat = heartbeat - 100")
+        self.queue.heartbeat(shard_id, "A")
+        self.assertEqual(self.queue.reclaim(60), 0)
+
+    def test_cancel(self):
+        """Cancelling leaves claimed shards to finish, uncancelling returns the cancelled shards to the pending pool"""
+        shard_id = self.queue.claim("A")[0]
+        self.assertEqual(self.queue.cancel(), 2)
+        self.status(claimed=1, cancelled=2)
+        self.assertIsNone(self.queue.claim("B"))
+        self.assertEqual(list(self.queue.cancelled('source')), [(10, 19), (20, 24)])
+        self.assertTrue(self.queue.complete(shard_id, "A", {'entities': []}))
+        self.assertEqual(self.queue.uncancel(), 2)
+        self.status(pending=2, done=1)
+        self.assertEqual(list(self.queue.cancelled('source')), [])
+
+def makeargs(tmpdir, **kwargs):
+    args = argparse.Namespace(queue=os.path.join(tmpdir, "queue.sqlite"), reset=False, shardsize=10, poll=0, stale=60,
+                              source=os.path.join(tmpdir, "source.txt"), target=os.path.join(tmpdir, "target.txt"), sourcelang='en', targetlang='nl',
+                              cands=None, anntype=None, annres=None, th=None, match=None, mcs=None, dens=None, extaida=False, postag=None, overlap='allow',
+                              locallinker=False, locallinkerthreshold=0.9, locallinkerminsupport=5)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+class TestCoordinator(unittest.TestCase):
+    """The coordinator is run with an exhausted budget, so it cancels the pending shards instead of waiting for workers"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for side in ('source', 'target'):
+            with open(os.path.join(self.tmpdir.name, side + ".txt"), 'w', encoding='utf-8') as f:
+                f.write("".join( side + " " + str(i) + "\n" for i in range(15) ))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def coordinate(self, args):
+        skipped = {'source': set(), 'target': set()}
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            entities = babelente.runcoordinator(args, 15, 15, 0, skipped, Budget(maxrequests=0))
+        return entities, skipped, stderr.getvalue()
+
+    def queue(self, args):
+        return WorkQueue(args.queue)
+
+    def test_publish(self):
+        """Shards alternate source and target, the lines of cancelled shards are skipped"""
+        args = makeargs(self.tmpdir.name)
+        entities, skipped, _ = self.coordinate(args)
+        self.assertEqual(entities, ([], []))
+        self.assertEqual(skipped, {'source': set(range(15)), 'target': set(range(15))})
+        queue = self.queue(args)
+        queue.uncancel()
+        self.assertEqual([ queue.claim("A")[1:] for _ in range(4) ], [('source', 0, 9), ('target', 0, 9), ('source', 10, 14), ('target', 10, 14)])
+        queue.close()
+
+    def test_resume(self):
+        """The same job is resumed: cancelled shards get another chance and finished shards are kept"""
+        args = makeargs(self.tmpdir.name)
+        self.coordinate(args)
+        queue = self.queue(args)
+        queue.uncancel()
+        shard_id = queue.claim("A")[0]
+        queue.complete(shard_id, "A", {'entities': [{'linenr': 0}], 'skipped': []})
+        queue.close()
+        entities, skipped, stderr = self.coordinate(args)
+        self.assertIn("Resuming", stderr)
+        self.assertEqual(entities, ([{'linenr': 0}], []))
+        self.assertEqual(skipped, {'source': set(range(10, 15)), 'target': set(range(15))})
+
+    def test_differentjob(self):
+        """A queue holding a different job is not resumed"""
+        self.coordinate(makeargs(self.tmpdir.name))
+        with self.assertRaises(SystemExit) as e:
+            self.coordinate(makeargs(self.tmpdir.name, targetlang='de'))
+        self.assertEqual(e.exception.code, 2)
+        with open(os.path.join(self.tmpdir.name, "source.txt"), 'a', encoding='utf-8') as f:
+            f.write("source 15\n")
+        with self.assertRaises(SystemExit):
+            self.coordinate(makeargs(self.tmpdir.name))
+
+    def test_reset(self):
+        """With --reset, a queue holding a different job is discarded and the new job is published"""
+        self.coordinate(makeargs(self.tmpdir.name))
+        args = makeargs(self.tmpdir.name, targetlang='de', reset=True)
+        _, _, stderr = self.coordinate(args)
+        self.assertIn("Discarding", stderr)
+        queue = self.queue(args)
+        self.assertEqual(queue.params()['targetlang'], 'de')
+        queue.close()
+
+if __name__ == '__main__':
+    unittest.main()